@@ -2,14 +2,86 @@
 AI Insights generation using Snowflake Cortex
 """
 
-from typing import Dict, List
+import heapq
+import json
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from typing import Dict, Iterator, List, Optional, Tuple
 import pandas as pd
+import streamlit as st
 from snowflake.snowpark.context import get_active_session
-from config import CORTEX_MODEL
+from config import CORTEX_MODEL_SUMMARY, CORTEX_MODEL_ANALYSIS, CORTEX_OPTIONS
 
+try:
+    from snowflake.cortex import complete as cortex_complete
+except ImportError:  # snowflake-ml-python not installed - summaries are returned in one piece
+    cortex_complete = None
 
-def generate_ai_summary(node_data: Dict, filtered_df: pd.DataFrame, metric_label: str) -> str:
-    """Generate AI summary using Snowflake Cortex via SQL"""
+# Streamed summaries kept per session for replay; the oldest is dropped past this
+MAX_STORED_SUMMARIES = 32
+
+# Static instructions are sent first and the per-node stats last, so every call
+# shares an identical prompt prefix that Claude can serve from its prompt cache
+STATIC_ANALYST_PREAMBLE = """You are a financial analyst reviewing Net Client Contribution (NCC) segments.
+Values are reported in US dollars and segments come from a Region > System > Profit Center > Practice Area hierarchy.
+Be concise, quantitative and specific to the segment statistics provided by the user."""
+
+SUMMARY_INSTRUCTIONS = """Provide a brief summary (3-4 sentences) about the NCC segment described by the user.
+Focus on: 1) Performance assessment 2) One actionable insight"""
+
+CHILD_INSIGHTS_INSTRUCTIONS = """Analyze the breakdown of the segment described by the user into its child components.
+
+Provide insights (4-5 sentences) covering:
+1) Which child segments are driving performance
+2) Any concentration risks or opportunities
+3) Patterns across the hierarchy levels
+4) One specific recommendation for this segment"""
+
+COMBINED_INSIGHTS_INSTRUCTIONS = """Analyze the segment described by the user and its child components.
+Respond with a single JSON object and nothing else, using exactly these keys:
+{"summary": "<3-4 sentences: 1) Performance assessment 2) One actionable insight>",
+ "child_insights": "<4-5 sentences: 1) Which child segments are driving performance 2) Any concentration risks or opportunities 3) Patterns across the hierarchy levels 4) One specific recommendation for this segment>"}"""
+
+
+@st.cache_data(ttl=900, show_spinner=False)
+def _cached_complete(model: str, messages_json: str, options_json: str) -> str:
+    """Run Cortex COMPLETE once per distinct model + prompt; reruns on the same node hit the cache"""
+    session = get_active_session()
+    result = session.sql(
+        "SELECT SNOWFLAKE.CORTEX.COMPLETE(?, PARSE_JSON(?), PARSE_JSON(?)) as response",
+        params=[model, messages_json, options_json]
+    ).collect()
+    if not result or result[0]['RESPONSE'] is None:
+        return "No response generated"
+    # The message-list form returns a JSON document rather than plain text
+    response = json.loads(result[0]['RESPONSE'])
+    return response['choices'][0]['messages']
+
+
+def _messages(instructions: str, segment_stats: str) -> List[Dict]:
+    """Static system block first, segment stats last"""
+    return [
+        {"role": "system", "content": f"{STATIC_ANALYST_PREAMBLE}\n\n{instructions}"},
+        {"role": "user", "content": segment_stats}
+    ]
+
+
+def _request(model: str, instructions: str, segment_stats: str,
+             max_tokens: int = CORTEX_OPTIONS["max_tokens"]) -> Tuple[str, str, str]:
+    """Serialized (model, messages, options) for one COMPLETE call"""
+    options = {**CORTEX_OPTIONS, "max_tokens": max_tokens}
+    return model, json.dumps(_messages(instructions, segment_stats)), json.dumps(options)
+
+
+def _complete(model: str, instructions: str, segment_stats: str, max_tokens: int = CORTEX_OPTIONS["max_tokens"]) -> str:
+    """Call Cortex COMPLETE with the static system block first and the segment stats last"""
+    # The serialized prompt already fingerprints the node (name, dimension, value,
+    # record count, top children), so it doubles as the cache key
+    return _cached_complete(*_request(model, instructions, segment_stats, max_tokens))
+
+
+def _summary_stats(node_data: Dict, filtered_df: pd.DataFrame) -> str:
+    """Describe the selected segment for the summary prompt"""
     node_name = node_data.get('name', 'Unknown')
     dimension = node_data.get('dimension', 'Unknown')
     value = node_data.get('value', 0)
@@ -17,7 +89,7 @@ def generate_ai_summary(node_data: Dict, filtered_df: pd.DataFrame, metric_label
 
     children_summary = ""
     if node_data.get('children'):
-        top_children = node_data['children'][:5]
+        top_children = heapq.nlargest(5, node_data['children'], key=itemgetter('value'))
         children_summary = "Top segments: " + ", ".join(
             [f"{c['name']} (${c['value']/1e6:.1f}M)" for c in top_children]
         )
@@ -29,45 +101,30 @@ def generate_ai_summary(node_data: Dict, filtered_df: pd.DataFrame, metric_label
         if total_py > 0:
             yoy_info = f"Year-over-year growth: {((total_ncc - total_py) / total_py) * 100:+.1f}%"
 
-    prompt = f"""You are a financial analyst. Provide a brief summary (3-4 sentences) about this NCC segment.
-Segment: {node_name} | Dimension: {dimension} | Value: ${value/1e6:.2f}M | Records: {record_count:,}
-{yoy_info} {children_summary}
-Focus on: 1) Performance assessment 2) One actionable insight"""
-
-    try:
-        session = get_active_session()
-        prompt_escaped = prompt.replace("'", "''")
-        result = session.sql(
-            f"SELECT SNOWFLAKE.CORTEX.COMPLETE('{CORTEX_MODEL}', '{prompt_escaped}') as response"
-        ).collect()
-        return result[0]['RESPONSE'] if result else "No response generated"
-    except Exception as e:
-        return f"Unable to generate insights: {str(e)}"
+    return f"""Segment: {node_name} | Dimension: {dimension} | Value: ${value/1e6:.2f}M | Records: {record_count:,}
+{yoy_info} {children_summary}"""
 
 
-def generate_child_insights(node_data: Dict, child_nodes: List[Dict], metric_label: str) -> str:
-    """Generate AI insights specifically about child nodes (1-2 levels below)"""
+def _child_stats(node_data: Dict, child_nodes: List[Dict]) -> str:
+    """Describe the child breakdown (1-2 levels below the segment) for the child prompt"""
     node_name = node_data.get('name', 'Unknown')
     dimension = node_data.get('dimension', 'Unknown')
     value = node_data.get('value', 0)
 
-    if not child_nodes:
-        return "No child segments available for analysis."
-
     # Build child summary
     level_1_nodes = [c for c in child_nodes if c['depth'] == 1]
     level_2_nodes = [c for c in child_nodes if c['depth'] == 2]
 
     level_1_summary = ""
     if level_1_nodes:
-        top_l1 = sorted(level_1_nodes, key=lambda x: x['value'], reverse=True)[:5]
+        top_l1 = heapq.nlargest(5, level_1_nodes, key=itemgetter('value'))
         level_1_summary = "Direct children: " + ", ".join(
             [f"{c['name']} (${c['value']/1e6:.2f}M, {c['count']:,} records)" for c in top_l1]
         )
 
     level_2_summary = ""
     if level_2_nodes:
-        top_l2 = sorted(level_2_nodes, key=lambda x: x['value'], reverse=True)[:5]
+        top_l2 = heapq.nlargest(5, level_2_nodes, key=itemgetter('value'))
         level_2_summary = "Grandchildren (top 5): " + ", ".join(
             [f"{c['name']} (${c['value']/1e6:.2f}M)" for c in top_l2]
         )
@@ -76,43 +133,121 @@ def generate_child_insights(node_data: Dict, child_nodes: List[Dict], metric_lab
     total_child_value = sum(c['value'] for c in level_1_nodes) if level_1_nodes else 0
     concentration = ""
     if level_1_nodes and total_child_value > 0:
-        top_child_pct = (level_1_nodes[0]['value'] / total_child_value * 100) if level_1_nodes else 0
+        top_child_pct = top_l1[0]['value'] / total_child_value * 100
         concentration = f"Top child concentration: {top_child_pct:.1f}% of segment total"
 
-    prompt = f"""You are a financial analyst. Analyze the breakdown of this segment into its child components.
-
-Parent Segment: {node_name} ({dimension}) - Total: ${value/1e6:.2f}M
+    return f"""Parent Segment: {node_name} ({dimension}) - Total: ${value/1e6:.2f}M
 {level_1_summary}
 {level_2_summary}
-{concentration}
+{concentration}"""
 
-Provide insights (4-5 sentences) covering:
-1) Which child segments are driving performance
-2) Any concentration risks or opportunities
-3) Patterns across the hierarchy levels
-4) One specific recommendation for this segment"""
 
+def _parse_combined_response(response: str) -> Tuple[Optional[str], Optional[str]]:
+    """Split a combined JSON response into (summary, child_insights), tolerating code fences.
+
+    A part the model left out or returned as something other than text, or a response
+    that is not a JSON object, comes back as None.
+    """
+    start, end = response.find('{'), response.rfind('}')
     try:
-        session = get_active_session()
-        prompt_escaped = prompt.replace("'", "''")
-        result = session.sql(
-            f"SELECT SNOWFLAKE.CORTEX.COMPLETE('{CORTEX_MODEL}', '{prompt_escaped}') as response"
-        ).collect()
-        return result[0]['RESPONSE'] if result else "No response generated"
+        parsed = json.loads(response[start:end + 1])
+    except ValueError:
+        return None, None
+    summary, child_insights = parsed.get('summary'), parsed.get('child_insights')
+    return (summary if isinstance(summary, str) else None,
+            child_insights if isinstance(child_insights, str) else None)
+
+
+def generate_ai_summary(node_data: Dict, filtered_df: pd.DataFrame, metric_label: str) -> str:
+    """Generate AI summary using Snowflake Cortex via SQL"""
+    try:
+        return _complete(CORTEX_MODEL_SUMMARY, SUMMARY_INSTRUCTIONS, _summary_stats(node_data, filtered_df))
+    except Exception as e:
+        return f"Unable to generate insights: {str(e)}"
+
+
+def stream_ai_summary(node_data: Dict, filtered_df: pd.DataFrame, metric_label: str) -> Iterator[str]:
+    """Yield the AI summary as Cortex streams it, so the panel can show the first sentence early"""
+    if cortex_complete is None:
+        yield generate_ai_summary(node_data, filtered_df, metric_label)
+        return
+    segment_stats = _summary_stats(node_data, filtered_df)
+    # st.cache_data cannot be filled from a generator, so finished streams are kept
+    # per session under the same key _cached_complete uses, and replayed on a repeat
+    completions = st.session_state.setdefault('summary_completions', {})
+    key = _request(CORTEX_MODEL_SUMMARY, SUMMARY_INSTRUCTIONS, segment_stats)
+    if key in completions:
+        # Re-insert so the dict stays ordered from least to most recently used
+        completions[key] = completions.pop(key)
+        yield completions[key]
+        return
+    chunks = []
+    try:
+        for chunk in cortex_complete(
+            CORTEX_MODEL_SUMMARY,
+            _messages(SUMMARY_INSTRUCTIONS, segment_stats),
+            options=CORTEX_OPTIONS,
+            session=get_active_session(),
+            stream=True
+        ):
+            chunks.append(chunk)
+            yield chunk
+    except Exception as e:
+        yield f"Unable to generate insights: {str(e)}"
+        return
+    completions[key] = "".join(chunks)
+    while len(completions) > MAX_STORED_SUMMARIES:
+        del completions[next(iter(completions))]
+
+
+def generate_child_insights(node_data: Dict, child_nodes: List[Dict], metric_label: str) -> str:
+    """Generate AI insights specifically about child nodes (1-2 levels below)"""
+    if not child_nodes:
+        return "No child segments available for analysis."
+
+    try:
+        return _complete(CORTEX_MODEL_ANALYSIS, CHILD_INSIGHTS_INSTRUCTIONS, _child_stats(node_data, child_nodes))
     except Exception as e:
         return f"Unable to generate child insights: {str(e)}"
 
 
+def generate_combined_insights(node_data: Dict, filtered_df: pd.DataFrame, child_nodes: List[Dict],
+                               metric_label: str) -> Tuple[str, Optional[str]]:
+    """Generate the segment summary and child insights with a single Cortex call"""
+    if not child_nodes:
+        return generate_ai_summary(node_data, filtered_df, metric_label), None
+
+    segment_stats = f"{_summary_stats(node_data, filtered_df)}\n\n{_child_stats(node_data, child_nodes)}"
+    try:
+        # Two answers in one response, so allow twice the single-answer token budget
+        summary, child_insights = _parse_combined_response(
+            _complete(CORTEX_MODEL_ANALYSIS, COMBINED_INSIGHTS_INSTRUCTIONS, segment_stats,
+                      max_tokens=2 * CORTEX_OPTIONS["max_tokens"])
+        )
+    except Exception as e:
+        return f"Unable to generate insights: {str(e)}", None
+    if summary is not None and child_insights is not None:
+        return summary, child_insights
+    # Keep whichever part did come back and only re-request the other
+    if summary is not None:
+        return summary, generate_child_insights(node_data, child_nodes, metric_label)
+    if child_insights is not None:
+        return generate_ai_summary(node_data, filtered_df, metric_label), child_insights
+
+    # Model ignored the JSON contract - issue both prompts concurrently so the
+    # fallback costs one extra round-trip rather than two
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        summary_future = executor.submit(generate_ai_summary, node_data, filtered_df, metric_label)
+        child_future = executor.submit(generate_child_insights, node_data, child_nodes, metric_label)
+        return summary_future.result(), child_future.result()
+
+
 def format_child_insights_html(node_data: Dict, child_nodes: List[Dict]) -> str:
     """Format child nodes as HTML for display below AI insights"""
     if not child_nodes:
         return ""
 
-    level_1_nodes = sorted(
-        [c for c in child_nodes if c['depth'] == 1],
-        key=lambda x: x['value'],
-        reverse=True
-    )[:5]
+    level_1_nodes = heapq.nlargest(5, (c for c in child_nodes if c['depth'] == 1), key=itemgetter('value'))
 
     html = '<div style="margin-top: 1rem;">'
     html += '<h5 style="color: #1B5E3F; font-size: 0.85rem; margin-bottom: 0.5rem;">Top Child Segments</h5>'
@@ -12,6 +12,7 @@ DATA_CONFIG = {
         "Avg_NCC": {"label": "Average NCC ($)"}
     },
     "dimensions": ["REGION", "SYSTEM", "PROFIT_CENTER", "PRACTICE_AREA"],
+    "filter_columns": ["DATA_SCENARIO", "YEAR", "MONTH_OF_YEAR"],
     "dimension_labels": {
         "REGION": "Region",
         "SYSTEM": "System",
@@ -21,8 +22,13 @@ DATA_CONFIG = {
 }
 
 # Cortex AI configuration - Latest models (2025)
-# Available: claude-4-opus, claude-4-sonnet, claude-3-7-sonnet, llama4-maverick, llama4-scout
-CORTEX_MODEL = "claude-3-7-sonnet"
+# Available: claude-4-opus, claude-4-sonnet, claude-3-7-sonnet, llama4-maverick, llama4-scout, snowflake-llama-3.3-70b
+# Short single-node summaries go to the cheaper, faster model; multi-level child analysis keeps Claude
+CORTEX_MODEL_SUMMARY = "snowflake-llama-3.3-70b"
+CORTEX_MODEL_ANALYSIS = "claude-3-7-sonnet"
+
+# COMPLETE options - prompts ask for 3-5 sentences, so capping max_tokens bounds decode time
+CORTEX_OPTIONS = {"temperature": 0.2, "max_tokens": 300}
 
 # Color palette - Surge/Beacon design system
 COLORS = {
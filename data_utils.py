@@ -2,17 +2,69 @@
 Data loading and processing utilities for NCC Decomposition Tree
 """
 
+import time
 import streamlit as st
+import numpy as np
 import pandas as pd
-from typing import Dict, List
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
 from snowflake.snowpark.context import get_active_session
+from config import DATA_CONFIG
+
+
+def _categorize_dimensions(df: pd.DataFrame) -> pd.DataFrame:
+    """Store the low-cardinality hierarchy columns as category so groupby works on integer codes"""
+    for col in DATA_CONFIG["dimensions"]:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    return df
 
 
 @st.cache_data(ttl=300)
-def load_data(table_name: str) -> pd.DataFrame:
-    """Load data from Snowflake table with caching"""
+def load_aggregated(table_name: str, group_columns: Tuple[str, ...]) -> pd.DataFrame:
+    """Aggregate NCC in Snowflake so only one row per group combination is transferred"""
+    # Column names come from DATA_CONFIG, not user input, so they are safe to inline
+    columns = ", ".join(group_columns)
     session = get_active_session()
-    return session.table(table_name).to_pandas()
+    df = _categorize_dimensions(session.sql(
+        f"SELECT {columns}, SUM(NCC) AS NCC, SUM(NCC_PY) AS NCC_PY, "
+        f"COUNT(NCC) AS NCC_COUNT, COUNT(*) AS RECORD_COUNT "
+        f"FROM {table_name} GROUP BY {columns}"
+    ).to_pandas())
+    # Stamped once per load (and kept by cache hits), so caches keyed on the
+    # selection rather than the frame's contents can tell reloads apart
+    df.attrs['loaded_at'] = time.time()
+    return df
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def filter_options(_df: pd.DataFrame, table_name: str, loaded_at: float) -> Dict[str, List]:
+    """Sidebar choices for each filter column, computed once per load of a table.
+
+    `_df` is not hashed, so the key is the table plus `load_aggregated`'s `loaded_at` stamp;
+    a reload recomputes the choices. Scenarios keep first-appearance order; years and months
+    come back sorted from np.unique.
+    """
+    return {
+        'DATA_SCENARIO': pd.unique(_df['DATA_SCENARIO'].to_numpy()).tolist(),
+        'YEAR': np.unique(_df['YEAR'].to_numpy()).tolist(),
+        'MONTH_OF_YEAR': np.unique(_df['MONTH_OF_YEAR'].to_numpy()).tolist()
+    }
+
+
+def filter_data(df: pd.DataFrame, scenario: str, years: List, months: List) -> pd.DataFrame:
+    """Filter to a data scenario and the selected years/months with one combined mask"""
+    mask = np.logical_and.reduce([
+        df['DATA_SCENARIO'].to_numpy() == scenario,
+        np.isin(df['YEAR'].to_numpy(), years),
+        np.isin(df['MONTH_OF_YEAR'].to_numpy(), months)
+    ])
+    return df if mask.all() else df[mask]
+
+
+def record_count(df: pd.DataFrame) -> int:
+    """Number of source records behind a frame; pre-aggregated frames carry RECORD_COUNT"""
+    return int(df['RECORD_COUNT'].sum()) if 'RECORD_COUNT' in df.columns else len(df)
 
 
 def calculate_metric(df: pd.DataFrame, metric: str) -> float:
@@ -27,6 +79,9 @@ def calculate_metric(df: pd.DataFrame, metric: str) -> float:
         ncc, ncc_py = df['NCC'].sum(), df['NCC_PY'].sum()
         return round(((ncc - ncc_py) / ncc_py) * 100, 1) if ncc_py != 0 else 0.0
     elif metric == "Avg_NCC":
+        if 'NCC_COUNT' in df.columns:
+            ncc_count = df['NCC_COUNT'].sum()
+            return round(df['NCC'].sum() / ncc_count, 2) if ncc_count else 0.0
         return round(df['NCC'].mean(), 2)
     return 0.0
 
@@ -53,50 +108,183 @@ def get_color(value: float, min_val: float, max_val: float, metric: str) -> str:
         return "#DC2626"
 
 
+def get_colors(values: np.ndarray, min_vals: np.ndarray, max_vals: np.ndarray, metric: str) -> np.ndarray:
+    """Vectorized get_color for a whole level of nodes"""
+    if metric == "YoY_Growth":
+        conditions = [values >= 10, values >= 0, values >= -10]
+    else:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            normalized = np.where(max_vals == min_vals, 0.5, (values - min_vals) / (max_vals - min_vals))
+        conditions = [normalized >= 0.7, normalized >= 0.5, normalized >= 0.3]
+    return np.select(conditions, ["#1B5E3F", "#2D8B5E", "#F59E0B"], default="#DC2626")
+
+
+def _metric_values(ncc: np.ndarray, ncc_py: np.ndarray, n_ncc: np.ndarray, metric: str) -> np.ndarray:
+    """Vectorized calculate_metric over per-group NCC / NCC_PY sums and NCC counts"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if metric == "NCC":
+            return np.round(ncc, 2)
+        elif metric == "NCC_PY":
+            return np.round(ncc_py, 2)
+        elif metric == "YoY_Growth":
+            return np.where(ncc_py != 0, np.round((ncc - ncc_py) / ncc_py * 100, 1), 0.0)
+        elif metric == "Avg_NCC":
+            return np.round(ncc / n_ncc, 2)
+    return np.zeros(len(ncc))
+
+
+@dataclass
+class TreeSoA:
+    """Breadth-first tree stored as parallel arrays; each node's children are contiguous"""
+    names: np.ndarray
+    dims: np.ndarray
+    values: np.ndarray
+    counts: np.ndarray
+    colors: np.ndarray
+    bars: np.ndarray
+    depth: np.ndarray
+    parent: np.ndarray
+    first_child: np.ndarray
+    n_children: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def children(self, i: int) -> range:
+        """Indices of node i's children, in descending value order"""
+        return range(self.first_child[i], self.first_child[i] + self.n_children[i])
+
+    def node_view(self, i: int) -> Dict:
+        """Materialize node i as the dict shape used by the UI (without children)"""
+        return {
+            "name": self.names[i],
+            "dimension": self.dims[i],
+            "value": float(self.values[i]),
+            "color": self.colors[i],
+            "count": int(self.counts[i])
+        }
+
+
+def build_tree_soa(df: pd.DataFrame, dimensions: List[str], metric: str) -> TreeSoA:
+    """Aggregate the hierarchy level by level into a TreeSoA (root at index 0)"""
+    # One array per level, concatenated at the end; level 0 is the root
+    names = [np.array(["Total NCC"], dtype=object)]
+    dims = [np.array(["Total"], dtype=object)]
+    values = [np.array([calculate_metric(df, metric)], dtype=float)]
+    counts = [np.array([record_count(df)], dtype=np.int64)]
+    colors = [np.array(["#1B5E3F"], dtype=object)]
+    bars = [np.zeros(1)]
+    depths = [np.zeros(1, dtype=np.int32)]
+    parents = [np.full(1, -1, dtype=np.int32)]
+
+    if dimensions and len(df) > 0:
+        if 'RECORD_COUNT' in df.columns:
+            count_aggs = dict(n_ncc=('NCC_COUNT', 'sum'), cnt=('RECORD_COUNT', 'sum'))
+        else:
+            count_aggs = dict(n_ncc=('NCC', 'count'), cnt=('NCC', 'size'))
+        # Aggregate values and record counts for every leaf combination in one pass;
+        # internal levels roll up from it. Keys stay sorted so value ties keep key order
+        leaf = df.groupby(dimensions, observed=True, dropna=False).agg(
+            ncc=('NCC', 'sum'), ncc_py=('NCC_PY', 'sum'), **count_aggs
+        )
+        index = {(): 0}
+        offset = 1
+        for depth, dim in enumerate(dimensions):
+            level = leaf if depth == len(dimensions) - 1 else leaf.groupby(
+                level=list(range(depth + 1)), observed=True, dropna=False, sort=False
+            ).sum()
+            keys = [key if isinstance(key, tuple) else (key,) for key in level.index]
+            # Per-level groupby skipped missing keys, so drop them and their descendants
+            keep = np.array([pd.notna(key[-1]) and key[:-1] in index for key in keys], dtype=bool)
+            level = level[keep]
+            keys = [key for key, kept in zip(keys, keep) if kept]
+            if not keys:
+                break
+
+            value_arr = _metric_values(level['ncc'].to_numpy(), level['ncc_py'].to_numpy(), level['n_ncc'].to_numpy(), metric)
+            parent_arr = np.array([index[key[:-1]] for key in keys], dtype=np.int32)
+            siblings = pd.Series(value_arr).groupby(parent_arr, sort=False)
+            level_colors = get_colors(
+                value_arr, siblings.transform('min').to_numpy(), siblings.transform('max').to_numpy(), metric
+            )
+            # Bar fill as a fraction of the sibling range of magnitudes, so the component needs no min/max pass
+            magnitudes = pd.Series(np.abs(value_arr)).groupby(parent_arr, sort=False)
+            min_abs = magnitudes.transform('min').to_numpy()
+            spans = magnitudes.transform('max').to_numpy() - min_abs
+            with np.errstate(divide='ignore', invalid='ignore'):
+                # Missing values (NaN averages) get an empty bar
+                level_bars = np.where((spans > 0) & np.isfinite(value_arr), (np.abs(value_arr) - min_abs) / spans, 0.0).round(3)
+            # Group siblings together in parent order, descending value within a parent;
+            # lexsort is stable, so ties keep the sorted key order
+            order = np.lexsort((-value_arr, parent_arr))
+            for position, i in enumerate(order, start=offset):
+                index[keys[i]] = position
+            offset += len(order)
+
+            names.append(np.array([str(keys[i][-1]) for i in order], dtype=object))
+            dims.append(np.full(len(order), dim, dtype=object))
+            values.append(value_arr[order])
+            counts.append(level['cnt'].to_numpy()[order].astype(np.int64))
+            colors.append(level_colors[order].astype(object))
+            bars.append(level_bars[order])
+            depths.append(np.full(len(order), depth + 1, dtype=np.int32))
+            parents.append(parent_arr[order])
+
+    parent = np.concatenate(parents)
+    n_children = np.bincount(parent[1:], minlength=len(parent)).astype(np.int32)
+    # Breadth-first with siblings grouped in parent order, so node i's children
+    # start right after all children of nodes 0..i-1
+    first_child = (1 + np.cumsum(n_children) - n_children).astype(np.int32)
+    return TreeSoA(
+        names=np.concatenate(names), dims=np.concatenate(dims), values=np.concatenate(values),
+        counts=np.concatenate(counts), colors=np.concatenate(colors), bars=np.concatenate(bars), depth=np.concatenate(depths),
+        parent=parent, first_child=first_child, n_children=n_children
+    )
+
+
+def hierarchy_from_tree(tree: TreeSoA, levels: int) -> Dict:
+    """Nested node dicts for the dropdown and AI prompts; the component reads the TreeSoA directly"""
+    nodes = [tree.node_view(i) for i in range(len(tree))]
+    # Leaves carry no children key; the root and internal levels always do
+    for i in np.flatnonzero((tree.depth < levels) | (tree.depth == 0)):
+        nodes[i]["children"] = [nodes[c] for c in tree.children(i)]
+    return nodes[0]
+
+
 def build_hierarchy(df: pd.DataFrame, dimensions: List[str], metric: str) -> Dict:
     """Build hierarchical tree structure from data"""
-    def build_level(data: pd.DataFrame, dims_remaining: List[str]) -> List[Dict]:
-        if not dims_remaining or len(data) == 0:
-            return []
-        current_dim, next_dims = dims_remaining[0], dims_remaining[1:]
-        groups = list(data.groupby(current_dim))
-        values = [calculate_metric(group, metric) for _, group in groups]
-        min_val, max_val = (min(values), max(values)) if values else (0, 1)
-        children = []
-        for (name, group), value in zip(groups, values):
-            node = {
-                "name": str(name),
-                "dimension": current_dim,
-                "value": value,
-                "color": get_color(value, min_val, max_val, metric),
-                "count": len(group)
-            }
-            if next_dims:
-                node["children"] = build_level(group, next_dims)
-            children.append(node)
-        return sorted(children, key=lambda x: x["value"], reverse=True)
-
-    root_value = calculate_metric(df, metric)
-    return {
-        "name": "Total NCC",
-        "dimension": "Total",
-        "value": root_value,
-        "color": "#1B5E3F",
-        "count": len(df),
-        "children": build_level(df, dimensions)
-    }
+    return hierarchy_from_tree(build_tree_soa(df, dimensions, metric), len(dimensions))
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def build_filtered_tree(_df: pd.DataFrame, filter_key: Tuple, dimensions: Tuple[str, ...], metric: str) -> TreeSoA:
+    """Cached build_tree_soa keyed on the filter selection instead of the filtered frame's contents.
+
+    `_df` is excluded from hashing, so `filter_key` must identify the source table, the load
+    it came from (`load_aggregated`'s `loaded_at` stamp) and every filter that produced it.
+    A reload changes the key, so trees from older data are never served; the TTL only evicts them.
+    """
+    return build_tree_soa(_df, list(dimensions), metric)
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def build_filtered_hierarchy(_tree: TreeSoA, filter_key: Tuple, dimensions: Tuple[str, ...], metric: str) -> Dict:
+    """Cached hierarchy_from_tree, keyed like build_filtered_tree since `_tree` is not hashed"""
+    return hierarchy_from_tree(_tree, len(dimensions))
 
 
-def flatten_tree(node: Dict, path: str = "") -> List[Dict]:
-    """Flatten tree structure into a list for dropdowns"""
-    current_path = f"{path} > {node['name']}" if path else node['name']
-    results = [{
-        'label': f"{node['dimension']}: {node['name']}",
-        'path': current_path,
-        'data': node
-    }]
-    for child in node.get('children', []):
-        results.extend(flatten_tree(child, current_path))
+def flatten_tree(node: Dict) -> List[Dict]:
+    """Flatten tree structure into a list for dropdowns (pre-order, iterative)"""
+    results = []
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        results.append({
+            'label': f"{current['dimension']}: {current['name']}",
+            'data': current
+        })
+        # Push in reverse so children are emitted in their original order
+        stack.extend(reversed(current.get('children', [])))
     return results
 
 
@@ -9,8 +9,16 @@ import streamlit as st
 import streamlit.components.v1 as components
 import pandas as pd
 import numpy as np
+import base64
 import json
-from typing import Dict, List, Optional
+import re
+import string
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # orjson not installed - fall back to the standard library encoder
+    orjson = None
 
 # Page config
 st.set_page_config(
@@ -24,7 +32,7 @@ st.set_page_config(
 # CUSTOM CSS - SURGE/BEACON DESIGN SYSTEM
 # ============================================
 
-st.markdown("""
+CUSTOM_CSS = """
 <style>
     /* Import clean font */
     @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap');
@@ -168,70 +176,103 @@ st.markdown("""
         border-radius: 50%;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+
+@st.cache_resource(show_spinner=False)
+def minified_css() -> str:
+    """CUSTOM_CSS without comments and indentation, minified once per process"""
+    css = re.sub(r"/\*.*?\*/", "", CUSTOM_CSS, flags=re.DOTALL)
+    css = re.sub(r"\s+", " ", css)
+    return re.sub(r"\s*([{};])\s*", r"\1", css).strip()
+
+
+st.markdown(minified_css(), unsafe_allow_html=True)
 
 
 # ============================================
 # DATA GENERATION
 # ============================================
 
-@st.cache_data
+# Read-only lookup tables for the mock dataset, built once at import
+MOCK_DIVISIONS = ['Brooklyn', 'Queens South', 'Staten Island', 'Bronx', 'Queens North', 'Manhattan']
+
+MOCK_DEPOTS = {
+    'Brooklyn': ['Jackie Gleason', 'Fresh Pond', 'East New York', 'Ulmer Park', 'Flatbush', 'Grand Avenue'],
+    'Queens South': ['Jamaica', 'JFK Depot', 'Rockaways'],
+    'Staten Island': ['Castleton', 'Charleston', 'Yukon'],
+    'Bronx': ['Gun Hill', 'Kingsbridge', 'West Farms'],
+    'Queens North': ['Casey Stengel', 'LaGuardia', 'College Point'],
+    'Manhattan': ['Mother Clara Hale', 'Manhattanville', 'Michael Quill']
+}
+
+MOCK_ROUTES = {
+    'Brooklyn': ['B37', 'B68', 'B16', 'B11', 'B4', 'B43', 'B70', 'B8', 'B61', 'B63'],
+    'Queens South': ['Q1', 'Q2', 'Q3', 'Q5', 'Q6'],
+    'Staten Island': ['S40', 'S44', 'S46', 'S48', 'S52'],
+    'Bronx': ['Bx1', 'Bx2', 'Bx4', 'Bx5', 'Bx6'],
+    'Queens North': ['Q15', 'Q16', 'Q17', 'Q19', 'Q20'],
+    'Manhattan': ['M1', 'M2', 'M3', 'M4', 'M5']
+}
+
+MOCK_DIRECTIONS = ['SB', 'NB']
+MOCK_PERIODS = ['Overnight', 'Midday', 'PM', 'AM']
+
+
+# Shared singleton rather than a per-hit copy; read-only: callers must not mutate it
+@st.cache_resource(show_spinner=False)
 def generate_mock_data() -> pd.DataFrame:
     """Generate realistic mock transit data similar to Power BI example"""
-    np.random.seed(42)
-
-    divisions = ['Brooklyn', 'Queens South', 'Staten Island', 'Bronx', 'Queens North', 'Manhattan']
-
-    depots = {
-        'Brooklyn': ['Jackie Gleason', 'Fresh Pond', 'East New York', 'Ulmer Park', 'Flatbush', 'Grand Avenue'],
-        'Queens South': ['Jamaica', 'JFK Depot', 'Rockaways'],
-        'Staten Island': ['Castleton', 'Charleston', 'Yukon'],
-        'Bronx': ['Gun Hill', 'Kingsbridge', 'West Farms'],
-        'Queens North': ['Casey Stengel', 'LaGuardia', 'College Point'],
-        'Manhattan': ['Mother Clara Hale', 'Manhattanville', 'Michael Quill']
-    }
-
-    routes_by_division = {
-        'Brooklyn': ['B37', 'B68', 'B16', 'B11', 'B4', 'B43', 'B70', 'B8', 'B61', 'B63'],
-        'Queens South': ['Q1', 'Q2', 'Q3', 'Q5', 'Q6'],
-        'Staten Island': ['S40', 'S44', 'S46', 'S48', 'S52'],
-        'Bronx': ['Bx1', 'Bx2', 'Bx4', 'Bx5', 'Bx6'],
-        'Queens North': ['Q15', 'Q16', 'Q17', 'Q19', 'Q20'],
-        'Manhattan': ['M1', 'M2', 'M3', 'M4', 'M5']
-    }
-
-    directions = ['SB', 'NB']
-    periods = ['Overnight', 'Midday', 'PM', 'AM']
-
-    data = []
-    for _ in range(3000):
-        division = np.random.choice(divisions, p=[0.25, 0.18, 0.12, 0.15, 0.15, 0.15])
-        depot = np.random.choice(depots[division])
-        route = np.random.choice(routes_by_division[division])
-        direction = np.random.choice(directions, p=[0.52, 0.48])
-        period = np.random.choice(periods, p=[0.15, 0.30, 0.30, 0.25])
-
-        base_otp = np.random.uniform(55, 78)
-        if division == 'Manhattan':
-            base_otp += 5
-        if period == 'Overnight':
-            base_otp -= 8
-        if period == 'AM':
-            base_otp += 3
-
-        otp = min(max(base_otp + np.random.uniform(-5, 5), 50), 85)
-
-        data.append({
-            'Division': division,
-            'Depot': depot,
-            'Route': route,
-            'Direction': direction,
-            'Period': period,
-            'OTP': round(otp, 1),
-            'Trips': np.random.randint(50, 500)
-        })
-
-    return pd.DataFrame(data)
+    rng = np.random.default_rng(42)
+
+    # Draw each column in bulk as integer codes rather than one row at a time
+    n = 3000
+    div_idx = rng.choice(len(MOCK_DIVISIONS), n, p=[0.25, 0.18, 0.12, 0.15, 0.15, 0.15])
+    period_idx = rng.choice(len(MOCK_PERIODS), n, p=[0.15, 0.30, 0.30, 0.25])
+
+    # Low-cardinality dimensions as category so groupby works on integer codes
+    def categorical(codes: np.ndarray, labels: List[str]) -> pd.Categorical:
+        """Categorical straight from codes, with the sorted, observed categories astype('category') gives"""
+        categories, remap = np.unique(labels, return_inverse=True)
+        return pd.Categorical.from_codes(remap[codes], categories).remove_unused_categories()
+
+    def pick_within_division(options: Dict[str, List[str]]) -> pd.Categorical:
+        """Uniformly pick each row's option from its division's list with one flat gather"""
+        sizes = np.array([len(options[d]) for d in MOCK_DIVISIONS])
+        flat = [o for d in MOCK_DIVISIONS for o in options[d]]
+        offsets = np.cumsum(sizes) - sizes
+        return categorical(offsets[div_idx] + rng.integers(0, sizes[div_idx]), flat)
+
+    division = categorical(div_idx, MOCK_DIVISIONS)
+    depot = pick_within_division(MOCK_DEPOTS)
+    route = pick_within_division(MOCK_ROUTES)
+    direction = categorical(rng.choice(len(MOCK_DIRECTIONS), n, p=[0.52, 0.48]), MOCK_DIRECTIONS)
+    period = categorical(period_idx, MOCK_PERIODS)
+
+    base_otp = rng.uniform(55, 78, n)
+    base_otp += 5 * (div_idx == MOCK_DIVISIONS.index('Manhattan'))
+    base_otp -= 8 * (period_idx == MOCK_PERIODS.index('Overnight'))
+    base_otp += 3 * (period_idx == MOCK_PERIODS.index('AM'))
+
+    otp = np.clip(base_otp + rng.uniform(-5, 5, n), 50, 85)
+
+    df = pd.DataFrame({
+        'Division': division,
+        'Depot': depot,
+        'Route': route,
+        'Direction': direction,
+        'Period': period,
+        'OTP': otp.round(1),
+        'Trips': rng.integers(50, 500, n)
+    })
+
+    # Trips-weighted OTP, so weighted averages are a ratio of two sums; it is
+    # computed before downcasting and kept float64 so rounded averages are exact
+    df['OTP_w'] = df['OTP'] * df['Trips']
+    # One-decimal OTP fits float32 and trip counts (50-499) fit int16
+    df['OTP'] = df['OTP'].astype(np.float32)
+    df['Trips'] = df['Trips'].astype(np.int16)
+    return df
 
 
 # ============================================
@@ -240,12 +281,25 @@ def generate_mock_data() -> pd.DataFrame:
 
 def calculate_metric(df: pd.DataFrame, metric: str) -> float:
     """Calculate metric value for a dataframe subset"""
+    # Plain ndarray reductions skip the Series.sum dispatch overhead
+    trips = df['Trips'].to_numpy()
     if metric == "OTP":
-        if len(df) == 0 or df['Trips'].sum() == 0:
+        total_trips = trips.sum()
+        if len(df) == 0 or total_trips == 0:
             return 0.0
-        return round(float(np.average(df['OTP'], weights=df['Trips'])), 1)
+        if 'OTP_w' in df.columns:
+            otp_w_sum = df['OTP_w'].to_numpy().sum()
+        else:
+            # One float64 dot product, no temporary products array
+            otp_w_sum = np.dot(df['OTP'].to_numpy(np.float64), trips.astype(np.float64))
+        return round(float(otp_w_sum / total_trips), 1)
     else:
-        return int(df['Trips'].sum())
+        return int(trips.sum())
+
+
+# Normalized lower bounds of each color band, and the colors from low to high
+COLOR_THRESHOLDS = np.array([0.3, 0.5, 0.7])
+COLOR_PALETTE = np.array(["#DC2626", "#F59E0B", "#2D8B5E", "#1B5E3F"])  # red, amber, medium green, primary green
 
 
 def get_color(value: float, min_val: float, max_val: float) -> str:
@@ -254,138 +308,205 @@ def get_color(value: float, min_val: float, max_val: float) -> str:
         normalized = 0.5
     else:
         normalized = (value - min_val) / (max_val - min_val)
+    # side='right' puts a value exactly on a threshold into the higher band
+    return str(COLOR_PALETTE[np.searchsorted(COLOR_THRESHOLDS, normalized, side='right')])
 
-    if normalized >= 0.7:
-        return "#1B5E3F"  # Primary green (high)
-    elif normalized >= 0.5:
-        return "#2D8B5E"  # Medium green
-    elif normalized >= 0.3:
-        return "#F59E0B"  # Amber (warning)
-    else:
-        return "#DC2626"  # Red (low)
+
+def get_colors(values: np.ndarray, min_vals: np.ndarray, max_vals: np.ndarray) -> np.ndarray:
+    """Vectorized get_color for a whole level of nodes"""
+    spans = max_vals - min_vals
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalized = np.where(spans == 0, 0.5, (values - min_vals) / spans)
+    return COLOR_PALETTE[np.searchsorted(COLOR_THRESHOLDS, normalized, side='right')]
 
 
 def build_hierarchy(df: pd.DataFrame, dimensions: List[str], metric: str) -> Dict:
     """Build a nested hierarchical structure for the tree"""
-
-    def build_level(data: pd.DataFrame, dims_remaining: List[str]) -> List[Dict]:
-        if not dims_remaining or len(data) == 0:
-            return []
-
-        current_dim = dims_remaining[0]
-        next_dims = dims_remaining[1:]
-
-        groups = list(data.groupby(current_dim))
-        children = []
-
-        values = [calculate_metric(group, metric) for _, group in groups]
-        min_val = min(values) if values else 0
-        max_val = max(values) if values else 1
-
-        for (name, group), value in zip(groups, values):
-            node = {
-                "name": str(name),
-                "dimension": current_dim,
-                "value": value,
-                "color": get_color(value, min_val, max_val),
-                "count": len(group)
-            }
-
-            if next_dims:
-                node["children"] = build_level(group, next_dims)
-
-            children.append(node)
-
-        children.sort(key=lambda x: x["value"], reverse=True)
-        return children
-
-    root_value = calculate_metric(df, metric)
     root = {
         "name": "Total",
         "dimension": "All Data",
-        "value": root_value,
+        "value": calculate_metric(df, metric),
         "color": "#1B5E3F",
         "count": len(df),
-        "children": build_level(df, dimensions)
+        "bar": 0.0,
+        "children": []
     }
-
+    if not dimensions or len(df) == 0:
+        return root
+
+    # One groupby over every dimension gives the leaf totals; internal levels roll up from it.
+    # OTP is carried as a trips-weighted sum so it stays additive across levels
+    if 'OTP_w' not in df.columns:
+        # Multiply in float64 even when OTP is stored as float32, as calculate_metric does
+        df = df.assign(OTP_w=df['OTP'].to_numpy(np.float64) * df['Trips'].to_numpy())
+    leaf = df.groupby(dimensions, observed=True, dropna=False).agg(
+        otp_w=('OTP_w', 'sum'), trips=('Trips', 'sum'), count=('Trips', 'size')
+    )
+    nodes = {(): root}
+    for depth, dim in enumerate(dimensions):
+        is_leaf = depth == len(dimensions) - 1
+        level = leaf if is_leaf else leaf.groupby(
+            level=list(range(depth + 1)), observed=True, dropna=False
+        ).sum()
+        keys = [key if isinstance(key, tuple) else (key,) for key in level.index]
+        # Per-level groupby skipped missing keys, so drop them and their descendants
+        keep = np.array([pd.notna(key[-1]) and key[:-1] in nodes for key in keys], dtype=bool)
+        level = level[keep]
+        keys = [key for key, kept in zip(keys, keep) if kept]
+        if not keys:
+            break
+
+        trips = level['trips'].to_numpy()
+        if metric == "OTP":
+            values = [round(float(w / t), 1) if t else 0.0 for w, t in zip(level['otp_w'].to_numpy(), trips)]
+        else:
+            values = [int(t) for t in trips]
+
+        # Colors are relative to siblings (children of the same parent)
+        value_arr = np.asarray(values)
+        siblings = pd.Series(value_arr, index=level.index)
+        if depth == 0:
+            min_vals = np.full(len(values), siblings.min())
+            max_vals = np.full(len(values), siblings.max())
+        else:
+            grouped = siblings.groupby(level=list(range(depth)), observed=True)
+            min_vals = grouped.transform('min').to_numpy()
+            max_vals = grouped.transform('max').to_numpy()
+
+        colors = get_colors(value_arr, min_vals, max_vals)
+        # Bar fill as a fraction of the sibling range, so the component needs no min/max pass
+        spans = max_vals - min_vals
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bars = np.where(spans > 0, (value_arr - min_vals) / spans, 0.0).round(3)
+        counts = level['count'].to_numpy()
+
+        # Every child is drawn, so this stays a full sort, but in NumPy; stable, so ties keep key order.
+        # The level is handled as parallel arrays; node dicts are only built here, already in order
+        order = np.argsort(-value_arr, kind='stable')
+        for i, color, count, bar in zip(
+            order.tolist(), colors[order].tolist(), counts[order].tolist(), bars[order].tolist()
+        ):
+            node = {
+                "name": str(keys[i][-1]),
+                "dimension": dim,
+                "value": values[i],
+                "color": color,
+                "count": count,
+                "bar": bar
+            }
+            if not is_leaf:
+                node["children"] = []
+            nodes[keys[i][:-1]]["children"].append(node)
+            nodes[keys[i]] = node
     return root
 
 
+@st.cache_data(show_spinner=False)
+def build_cached_hierarchy(dimensions: Tuple[str, ...], metric: str) -> Dict:
+    """Hierarchy over the mock dataset, built once per dimension order and metric"""
+    return build_hierarchy(generate_mock_data(), list(dimensions), metric)
+
+
 # ============================================
 # VISUALIZATION - SURGE/BEACON THEMED
 # ============================================
 
-def create_tree_visualization(tree_data: Dict, metric: str) -> str:
-    """Create pure JavaScript/SVG collapsible tree with Surge/Beacon styling"""
-
-    tree_json = json.dumps(tree_data)
-    format_type = "percent" if metric == "OTP" else "number"
-
-    html = f'''
+def pack_uints(values) -> Dict:
+    """Non-negative integers as base64 of the narrowest little-endian unsigned typed array"""
+    arr = np.asarray(values, dtype=np.int64)
+    top = int(arr.max(initial=0))
+    kind = "u1" if top < 1 << 8 else "u2" if top < 1 << 16 else "u4"
+    return {"type": kind, "b64": base64.b64encode(arr.astype("<" + kind).tobytes()).decode("ascii")}
+
+
+def encode_tree(tree_data: Dict) -> Dict:
+    """Columnar breadth-first encoding of the tree: one array per field plus string tables"""
+    # Appending while iterating walks the tree breadth-first, so each node's
+    # children occupy a contiguous run and only their count needs to be sent
+    nodes = [tree_data]
+    for node in nodes:
+        nodes.extend(node.get("children", []))
+
+    payload = {}
+    for field, key in (("names", "name"), ("dims", "dimension"), ("colors", "color")):
+        table, ids = np.unique([n[key] for n in nodes], return_inverse=True)
+        payload[field] = table.tolist()
+        payload[key] = pack_uints(ids)
+    # Values and counts stay JSON numbers, which are shorter than their base64 binary;
+    # NaN (an OTP average over missing values) goes out as null on both serializer paths
+    payload["value"] = [n["value"] if np.isfinite(n["value"]) else None for n in nodes]
+    payload["count"] = [n["count"] for n in nodes]
+    # Bars are rounded to 3 decimals, so they travel exactly as per-mille integers
+    payload["bar"] = pack_uints(np.rint(np.array([n["bar"] for n in nodes]) * 1000))
+    payload["nChildren"] = pack_uints([len(n.get("children", [])) for n in nodes])
+    return payload
+
+
+# Module-level template so the page is parsed once; $$ escapes JS template-literal dollars
+TREE_HTML_TEMPLATE = string.Template('''
 <!DOCTYPE html>
 <html>
 <head>
 <style>
 @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600&display=swap');
 
-* {{ margin: 0; padding: 0; box-sizing: border-box; }}
+* { margin: 0; padding: 0; box-sizing: border-box; }
 
-body {{
+body {
     font-family: 'Inter', -apple-system, BlinkMacSystemFont, sans-serif;
     background: #FFFFFF;
     color: #1F2937;
-}}
+}
 
-.tree-container {{
+.tree-container {
     padding: 24px;
     background: #FFFFFF;
     border-radius: 12px;
     border: 1px solid #E5E7EB;
     margin: 8px;
     box-shadow: 0 1px 3px rgba(0,0,0,0.05);
-}}
+}
 
-svg {{ overflow: visible; }}
+svg { overflow: visible; }
 
-.node {{ cursor: pointer; }}
+.node { cursor: pointer; }
 
-.node-rect {{
+.node-rect {
     fill: #FFFFFF;
     stroke: #E5E7EB;
     stroke-width: 1px;
     rx: 8px;
     transition: all 0.2s;
-}}
+}
 
-.node:hover .node-rect {{
+.node:hover .node-rect {
     stroke: #1B5E3F;
     stroke-width: 2px;
     filter: drop-shadow(0 2px 4px rgba(27, 94, 63, 0.1));
-}}
+}
 
-.node-circle {{
+.node-circle {
     stroke-width: 2px;
     transition: all 0.2s;
-}}
+}
 
-.node-text {{
+.node-text {
     font-family: 'Inter', sans-serif;
     font-size: 13px;
     font-weight: 500;
     fill: #1F2937;
     pointer-events: none;
-}}
+}
 
-.node-value {{
+.node-value {
     font-family: 'Inter', sans-serif;
     font-size: 12px;
     font-weight: 600;
     fill: #1B5E3F;
     pointer-events: none;
-}}
+}
 
-.node-dimension {{
+.node-dimension {
     font-family: 'Inter', sans-serif;
     font-size: 10px;
     font-weight: 500;
@@ -393,30 +514,30 @@ svg {{ overflow: visible; }}
     pointer-events: none;
     text-transform: uppercase;
     letter-spacing: 0.5px;
-}}
+}
 
-.node-bar-bg {{
+.node-bar-bg {
     fill: #F3F4F6;
     rx: 3px;
-}}
+}
 
-.node-bar {{
+.node-bar {
     rx: 3px;
     transition: width 0.3s;
-}}
+}
 
-.link {{
+.link {
     fill: none;
     stroke: #D1D5DB;
     stroke-width: 1.5px;
-}}
+}
 
-.link-active {{
+.link-active {
     stroke: #1B5E3F;
     stroke-opacity: 0.6;
-}}
+}
 
-.tooltip {{
+.tooltip {
     position: fixed;
     background: #1F2937;
     color: #FFFFFF;
@@ -430,33 +551,33 @@ svg {{ overflow: visible; }}
     max-width: 220px;
     box-shadow: 0 10px 25px rgba(0,0,0,0.2);
     line-height: 1.5;
-}}
+}
 
-.tooltip strong {{
+.tooltip strong {
     color: #FFFFFF;
     font-weight: 600;
-}}
+}
 
-.tooltip .label {{
+.tooltip .label {
     color: #9CA3AF;
     font-size: 11px;
     text-transform: uppercase;
     letter-spacing: 0.5px;
     margin-top: 8px;
     display: block;
-}}
+}
 
-.tooltip .value {{
+.tooltip .value {
     color: #10B981;
     font-weight: 600;
-}}
+}
 
-.expand-icon {{
+.expand-icon {
     font-family: 'Inter', sans-serif;
     font-size: 14px;
     font-weight: 600;
     pointer-events: none;
-}}
+}
 </style>
 </head>
 <body>
@@ -464,270 +585,333 @@ svg {{ overflow: visible; }}
     <svg id="tree-svg"></svg>
 </div>
 <div id="tooltip" class="tooltip"></div>
+<script id="tree-data" type="application/json">$tree_json</script>
 
 <script>
-(function() {{
+(function() {
     "use strict";
 
-    const data = {tree_json};
-    const formatType = "{format_type}";
+    const formatType = "$format_type";
 
-    const config = {{
+    const config = {
         nodeWidth: 160,
         nodeHeight: 65,
         levelGap: 200,
         siblingGap: 12,
         barWidth: 80,
         barHeight: 6,
-        margin: {{ top: 40, right: 160, bottom: 40, left: 60 }}
-    }};
+        margin: { top: 40, right: 160, bottom: 40, left: 60 }
+    };
 
-    let nodeId = 0;
     let root = null;
+    const nodeById = {};
 
-    function formatValue(val) {{
-        return formatType === "percent" ? val.toFixed(1) + "%" : val.toLocaleString();
-    }}
-
-    function processNode(node, depth) {{
-        node.id = ++nodeId;
-        node.depth = depth;
-        node.expanded = depth < 1;
-
-        if (node.children && node.children.length > 0) {{
-            node.children.forEach(child => {{
-                child.parent = node;
-                processNode(child, depth + 1);
-            }});
-        }}
+    const typedArrays = { u1: Uint8Array, u2: Uint16Array, u4: Uint32Array };
+
+    function unpack(col) {
+        const bytes = Uint8Array.from(atob(col.b64), c => c.charCodeAt(0));
+        return new typedArrays[col.type](bytes.buffer);
+    }
+
+    // Data block is plain JSON, so JSON.parse handles it instead of the JS parser;
+    // small-integer columns arrive as base64 typed arrays
+    const payload = JSON.parse(document.getElementById("tree-data").textContent);
+    ["name", "dimension", "color", "bar", "nChildren"].forEach(key => {
+        payload[key] = unpack(payload[key]);
+    });
+    // Breadth-first order: each node's children follow the previous node's children
+    const childStart = [];
+    let next = 1;
+    payload.nChildren.forEach(n => {
+        childStart.push(next);
+        next += n;
+    });
+
+    // Node objects are decoded on demand: the root up front, and a node's children
+    // the first time it is expanded, so collapsed subtrees are never materialized
+    function decodeNode(i, depth) {
+        const p = payload;
+        const node = {
+            id: i,
+            name: p.names[p.name[i]],
+            dimension: p.dims[p.dimension[i]],
+            value: p.value[i],
+            count: p.count[i],
+            bar: p.bar[i] / 1000,
+            color: p.colors[p.color[i]],
+            depth: depth,
+            expanded: false,
+            childCount: p.nChildren[i],
+            children: null,
+            // Formatted once here; redraws and the tooltip reuse the strings
+            valueText: formatValue(p.value[i]),
+            countText: p.count[i] ? p.count[i].toLocaleString() : 'N/A'
+        };
+        nodeById[i] = node;
         return node;
-    }}
+    }
+
+    function expand(node) {
+        if (node.children === null) {
+            node.children = [];
+            for (let j = childStart[node.id]; j < childStart[node.id] + node.childCount; j++) {
+                node.children.push(decodeNode(j, node.depth + 1));
+            }
+        }
+        node.expanded = true;
+    }
+
+    function formatValue(val) {
+        if (val === null || !isFinite(val)) return "N/A";
+        return formatType === "percent" ? val.toFixed(1) + "%" : val.toLocaleString();
+    }
 
-    function calculateLayout(node) {{
+    function calculateLayout(node) {
         let yOffset = 0;
 
-        function layoutNode(n, x) {{
+        function layoutNode(n, x) {
             n.x = x;
 
-            if (n.expanded && n.children && n.children.length > 0) {{
-                n.children.forEach(child => {{
+            if (n.expanded && n.children && n.children.length > 0) {
+                n.children.forEach(child => {
                     layoutNode(child, x + config.levelGap);
-                }});
+                });
                 const firstChild = n.children[0];
                 const lastChild = n.children[n.children.length - 1];
                 n.y = (firstChild.y + lastChild.y) / 2;
-            }} else {{
+            } else {
                 n.y = yOffset;
                 yOffset += config.nodeHeight + config.siblingGap;
-            }}
-        }}
+            }
+        }
 
         layoutNode(node, config.margin.left);
         return yOffset;
-    }}
+    }
 
-    function getVisibleNodes(node, nodes) {{
+    function getVisibleNodes(node, nodes) {
         nodes = nodes || [];
         nodes.push(node);
-        if (node.expanded && node.children) {{
+        if (node.expanded && node.children) {
             node.children.forEach(child => getVisibleNodes(child, nodes));
-        }}
+        }
         return nodes;
-    }}
+    }
 
-    function getVisibleLinks(node, links) {{
+    function getVisibleLinks(node, links) {
         links = links || [];
-        if (node.expanded && node.children) {{
-            node.children.forEach(child => {{
-                links.push({{ source: node, target: child }});
+        if (node.expanded && node.children) {
+            node.children.forEach(child => {
+                links.push({ source: node, target: child });
                 getVisibleLinks(child, links);
-            }});
-        }}
+            });
+        }
         return links;
-    }}
+    }
 
-    function linkPath(source, target) {{
+    function linkPath(source, target) {
         const midX = (source.x + config.nodeWidth/2 + target.x) / 2;
         const sy = source.y + config.nodeHeight/2;
         const ty = target.y + config.nodeHeight/2;
         const sx = source.x + config.nodeWidth;
         const tx = target.x;
 
-        return `M${{sx}},${{sy}} C${{midX}},${{sy}} ${{midX}},${{ty}} ${{tx}},${{ty}}`;
-    }}
+        return `M$${sx},$${sy} C$${midX},$${sy} $${midX},$${ty} $${tx},$${ty}`;
+    }
+
+    function escapeXml(text) {
+        return String(text).replace(/[&<>"]/g, c => ({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"})[c]);
+    }
+
+    function nodeMarkup(node) {
+        const hasChildren = node.childCount > 0;
+        const label = node.name.length > 16 ? node.name.substring(0, 14) + "..." : node.name;
+        const parts = [
+            `<g class="node" data-nid="$${node.id}" transform="translate($${node.x},$${node.y})" style="cursor: $${hasChildren ? "pointer" : "default"}">`,
+            // Card background
+            `<rect class="node-rect" width="$${config.nodeWidth}" height="$${config.nodeHeight}" rx="8"></rect>`,
+            // Color indicator (left edge)
+            `<rect x="0" y="0" width="4" height="$${config.nodeHeight}" rx="4 0 0 4" fill="$${node.color}"></rect>`,
+            // Dimension label, name and value
+            `<text class="node-dimension" x="14" y="16">$${escapeXml(node.dimension)}</text>`,
+            `<text class="node-text" x="14" y="32">$${escapeXml(label)}</text>`,
+            `<text class="node-value" x="14" y="48">$${node.valueText}</text>`,
+            // Bar background and fill; the fill fraction comes precomputed from Python
+            `<rect class="node-bar-bg" x="14" y="54" width="$${config.barWidth}" height="$${config.barHeight}"></rect>`,
+            `<rect class="node-bar" x="14" y="54" width="$${Math.max(4, node.bar * config.barWidth)}" height="$${config.barHeight}" fill="$${node.color}"></rect>`
+        ];
+
+        // Expand/collapse button
+        if (hasChildren) {
+            parts.push(
+                `<g transform="translate($${config.nodeWidth - 24}, $${config.nodeHeight/2 - 10})">`,
+                `<rect width="20" height="20" rx="4" fill="$${node.expanded ? "#F3F4F6" : "#1B5E3F"}"></rect>`,
+                `<text class="expand-icon" x="10" y="14" text-anchor="middle" fill="$${node.expanded ? "#6B7280" : "#FFFFFF"}">$${node.expanded ? "−" : "+"}</text>`,
+                `</g>`
+            );
+        }
+        parts.push(`</g>`);
+        return parts.join("");
+    }
+
+    // Elements currently drawn, keyed by node id (a link is keyed by its child's id)
+    const nodeEls = new Map();
+    const linkEls = new Map();
+    let linkLayer = null;
+    let nodeLayer = null;
+
+    function appendMarkup(layer, markup, drawn) {
+        // Parse a batch of new elements once, then register and move them into place
+        const scratch = document.createElementNS("http://www.w3.org/2000/svg", "g");
+        scratch.innerHTML = markup;
+        while (scratch.firstElementChild) {
+            const el = scratch.firstElementChild;
+            drawn.set(Number(el.getAttribute("data-nid")), el);
+            layer.appendChild(el);
+        }
+    }
 
-    function render() {{
+    function render(toggled) {
         const height = calculateLayout(root);
-        const svg = document.getElementById("tree-svg");
         const totalHeight = Math.max(400, height + config.margin.top + config.margin.bottom);
         const totalWidth = 1100;
 
         svg.setAttribute("width", totalWidth);
         svg.setAttribute("height", totalHeight);
-        svg.innerHTML = "";
 
-        const g = document.createElementNS("http://www.w3.org/2000/svg", "g");
-        g.setAttribute("transform", `translate(0,${{config.margin.top}})`);
-        svg.appendChild(g);
+        if (!nodeLayer) {
+            const g = document.createElementNS("http://www.w3.org/2000/svg", "g");
+            g.setAttribute("transform", `translate(0,$${config.margin.top})`);
+            // Links layer first so nodes paint above them
+            linkLayer = document.createElementNS("http://www.w3.org/2000/svg", "g");
+            nodeLayer = document.createElementNS("http://www.w3.org/2000/svg", "g");
+            g.appendChild(linkLayer);
+            g.appendChild(nodeLayer);
+            svg.appendChild(g);
+        }
 
         const nodes = getVisibleNodes(root);
         const links = getVisibleLinks(root);
+        const visible = new Set(nodes.map(n => n.id));
 
-        // Draw links
-        links.forEach(link => {{
-            const path = document.createElementNS("http://www.w3.org/2000/svg", "path");
-            path.setAttribute("class", "link");
-            path.setAttribute("d", linkPath(link.source, link.target));
-            g.appendChild(path);
-        }});
-
-        // Draw nodes
-        nodes.forEach(node => {{
-            const nodeGroup = document.createElementNS("http://www.w3.org/2000/svg", "g");
-            nodeGroup.setAttribute("class", "node");
-            nodeGroup.setAttribute("transform", `translate(${{node.x}},${{node.y}})`);
-
-            const hasChildren = node.children && node.children.length > 0;
-
-            if (hasChildren) {{
-                nodeGroup.onclick = function(e) {{
-                    e.stopPropagation();
-                    node.expanded = !node.expanded;
-                    render();
-                }};
-                nodeGroup.style.cursor = "pointer";
-            }} else {{
-                nodeGroup.style.cursor = "default";
-            }}
-
-            // Tooltip
-            nodeGroup.onmouseenter = function(e) {{
-                const tooltip = document.getElementById("tooltip");
-                tooltip.innerHTML = `
-                    <strong>${{node.name}}</strong>
-                    <span class="label">${{node.dimension}}</span>
-                    <span class="label">Value</span>
-                    <span class="value">${{formatValue(node.value)}}</span>
-                    <span class="label">Records</span>
-                    ${{node.count ? node.count.toLocaleString() : 'N/A'}}
-                `;
-                tooltip.style.display = "block";
-                tooltip.style.left = (e.clientX + 15) + "px";
-                tooltip.style.top = (e.clientY - 10) + "px";
-            }};
-            nodeGroup.onmouseleave = function() {{
-                document.getElementById("tooltip").style.display = "none";
-            }};
-            nodeGroup.onmousemove = function(e) {{
-                const tooltip = document.getElementById("tooltip");
-                tooltip.style.left = (e.clientX + 15) + "px";
-                tooltip.style.top = (e.clientY - 10) + "px";
-            }};
+        // Remove what a collapse hid, and the toggled node so its button is redrawn
+        nodeEls.forEach((el, id) => {
+            if (!visible.has(id) || (toggled && id === toggled.id)) {
+                el.remove();
+                nodeEls.delete(id);
+            }
+        });
+        linkEls.forEach((el, id) => {
+            if (!visible.has(id)) {
+                el.remove();
+                linkEls.delete(id);
+            }
+        });
+
+        // Elements already drawn only move; new ones are built as one markup batch per layer
+        const newLinks = [];
+        links.forEach(link => {
+            const d = linkPath(link.source, link.target);
+            const el = linkEls.get(link.target.id);
+            if (!el) {
+                newLinks.push(`<path class="link" data-nid="$${link.target.id}" d="$${d}"></path>`);
+            } else if (el.getAttribute("d") !== d) {
+                el.setAttribute("d", d);
+            }
+        });
+        const newNodes = [];
+        nodes.forEach(node => {
+            const el = nodeEls.get(node.id);
+            const transform = `translate($${node.x},$${node.y})`;
+            if (!el) {
+                newNodes.push(nodeMarkup(node));
+            } else if (el.getAttribute("transform") !== transform) {
+                el.setAttribute("transform", transform);
+            }
+        });
+        appendMarkup(linkLayer, newLinks.join(""), linkEls);
+        appendMarkup(nodeLayer, newNodes.join(""), nodeEls);
+    }
 
-            // Card background
-            const rect = document.createElementNS("http://www.w3.org/2000/svg", "rect");
-            rect.setAttribute("class", "node-rect");
-            rect.setAttribute("width", config.nodeWidth);
-            rect.setAttribute("height", config.nodeHeight);
-            rect.setAttribute("rx", 8);
-            nodeGroup.appendChild(rect);
+    // Delegated handlers, so node elements carry no listeners of their own
+    function nodeFromEvent(e) {
+        const el = e.target.closest(".node");
+        return el ? nodeById[el.getAttribute("data-nid")] : null;
+    }
 
-            // Color indicator (left edge)
-            const indicator = document.createElementNS("http://www.w3.org/2000/svg", "rect");
-            indicator.setAttribute("x", 0);
-            indicator.setAttribute("y", 0);
-            indicator.setAttribute("width", 4);
-            indicator.setAttribute("height", config.nodeHeight);
-            indicator.setAttribute("rx", "4 0 0 4");
-            indicator.setAttribute("fill", node.color);
-            nodeGroup.appendChild(indicator);
-
-            // Dimension label
-            const dimText = document.createElementNS("http://www.w3.org/2000/svg", "text");
-            dimText.setAttribute("class", "node-dimension");
-            dimText.setAttribute("x", 14);
-            dimText.setAttribute("y", 16);
-            dimText.textContent = node.dimension;
-            nodeGroup.appendChild(dimText);
-
-            // Name
-            const nameText = document.createElementNS("http://www.w3.org/2000/svg", "text");
-            nameText.setAttribute("class", "node-text");
-            nameText.setAttribute("x", 14);
-            nameText.setAttribute("y", 32);
-            nameText.textContent = node.name.length > 16 ? node.name.substring(0, 14) + "..." : node.name;
-            nodeGroup.appendChild(nameText);
-
-            // Value
-            const valueText = document.createElementNS("http://www.w3.org/2000/svg", "text");
-            valueText.setAttribute("class", "node-value");
-            valueText.setAttribute("x", 14);
-            valueText.setAttribute("y", 48);
-            valueText.textContent = formatValue(node.value);
-            nodeGroup.appendChild(valueText);
-
-            // Bar background
-            const barBg = document.createElementNS("http://www.w3.org/2000/svg", "rect");
-            barBg.setAttribute("class", "node-bar-bg");
-            barBg.setAttribute("x", 14);
-            barBg.setAttribute("y", 54);
-            barBg.setAttribute("width", config.barWidth);
-            barBg.setAttribute("height", config.barHeight);
-            nodeGroup.appendChild(barBg);
-
-            // Bar fill
-            const siblings = node.parent ? node.parent.children : [node];
-            const values = siblings.map(s => s.value);
-            const maxVal = Math.max(...values);
-            const minVal = Math.min(...values);
-            const range = maxVal - minVal || 1;
-            const barFillWidth = Math.max(4, ((node.value - minVal) / range) * config.barWidth);
-
-            const barFill = document.createElementNS("http://www.w3.org/2000/svg", "rect");
-            barFill.setAttribute("class", "node-bar");
-            barFill.setAttribute("x", 14);
-            barFill.setAttribute("y", 54);
-            barFill.setAttribute("width", barFillWidth);
-            barFill.setAttribute("height", config.barHeight);
-            barFill.setAttribute("fill", node.color);
-            nodeGroup.appendChild(barFill);
-
-            // Expand/collapse button
-            if (hasChildren) {{
-                const btnGroup = document.createElementNS("http://www.w3.org/2000/svg", "g");
-                btnGroup.setAttribute("transform", `translate(${{config.nodeWidth - 24}}, ${{config.nodeHeight/2 - 10}})`);
-
-                const btnBg = document.createElementNS("http://www.w3.org/2000/svg", "rect");
-                btnBg.setAttribute("width", 20);
-                btnBg.setAttribute("height", 20);
-                btnBg.setAttribute("rx", 4);
-                btnBg.setAttribute("fill", node.expanded ? "#F3F4F6" : "#1B5E3F");
-                btnGroup.appendChild(btnBg);
-
-                const btnText = document.createElementNS("http://www.w3.org/2000/svg", "text");
-                btnText.setAttribute("class", "expand-icon");
-                btnText.setAttribute("x", 10);
-                btnText.setAttribute("y", 14);
-                btnText.setAttribute("text-anchor", "middle");
-                btnText.setAttribute("fill", node.expanded ? "#6B7280" : "#FFFFFF");
-                btnText.textContent = node.expanded ? "−" : "+";
-                btnGroup.appendChild(btnText);
-
-                nodeGroup.appendChild(btnGroup);
-            }}
-
-            g.appendChild(nodeGroup);
-        }});
-    }}
-
-    root = processNode(data, 0);
+    const svg = document.getElementById("tree-svg");
+    const tooltip = document.getElementById("tooltip");
+    let hovered = null;
+
+    svg.addEventListener("click", function(e) {
+        const node = nodeFromEvent(e);
+        if (node && node.childCount > 0) {
+            e.stopPropagation();
+            if (node.expanded) {
+                node.expanded = false;
+            } else {
+                expand(node);
+            }
+            render(node);
+        }
+    });
+
+    // Tooltip
+    svg.addEventListener("mousemove", function(e) {
+        const node = nodeFromEvent(e);
+        if (!node) {
+            tooltip.style.display = "none";
+            hovered = null;
+            return;
+        }
+        if (node !== hovered) {
+            hovered = node;
+            tooltip.innerHTML = `
+                <strong>$${node.name}</strong>
+                <span class="label">$${node.dimension}</span>
+                <span class="label">Value</span>
+                <span class="value">$${node.valueText}</span>
+                <span class="label">Records</span>
+                $${node.countText}
+            `;
+            tooltip.style.display = "block";
+        }
+        tooltip.style.left = (e.clientX + 15) + "px";
+        tooltip.style.top = (e.clientY - 10) + "px";
+    });
+    svg.addEventListener("mouseleave", function() {
+        tooltip.style.display = "none";
+        hovered = null;
+    });
+
+    root = decodeNode(0, 0);
+    expand(root);
     render();
-}})();
+})();
 </script>
 </body>
 </html>
-'''
-    return html
+''')
+
+
+def create_tree_visualization(tree_data: Dict, metric: str) -> str:
+    """Create pure JavaScript/SVG collapsible tree with Surge/Beacon styling"""
+    payload = encode_tree(tree_data)
+    if orjson is not None:
+        tree_json = orjson.dumps(payload).decode()
+    else:
+        tree_json = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    # A "</" inside a name would close the data block early; "<\/" is the same JSON string
+    return TREE_HTML_TEMPLATE.substitute(
+        tree_json=tree_json.replace("</", "<\\/"),
+        format_type="percent" if metric == "OTP" else "number"
+    )
+
+
+@st.cache_data(show_spinner=False)
+def build_cached_tree_html(dimensions: Tuple[str, ...], metric: str) -> str:
+    """Tree component HTML, rendered once per dimension order and metric"""
+    return create_tree_visualization(build_cached_hierarchy(dimensions, metric), metric)
 
 
 # ============================================
@@ -758,7 +942,9 @@ if 'selected_dimensions' not in st.session_state:
 # ============================================
 
 def main():
-    df = generate_mock_data()
+    # Bind the config lookups the sidebar uses more than once
+    metrics = DATA_CONFIG["metrics"]
+    metric_keys = list(metrics)
 
     # Sidebar
     with st.sidebar:
@@ -766,9 +952,9 @@ def main():
 
         selected_metric = st.selectbox(
             "Metric",
-            options=list(DATA_CONFIG["metrics"].keys()),
-            format_func=lambda x: DATA_CONFIG["metrics"][x]["label"],
-            index=list(DATA_CONFIG["metrics"].keys()).index(st.session_state.selected_metric)
+            options=metric_keys,
+            format_func=lambda x: metrics[x]["label"],
+            index=metric_keys.index(st.session_state.selected_metric)
         )
         st.session_state.selected_metric = selected_metric
 
@@ -830,20 +1016,25 @@ def main():
     st.markdown('<span class="category-badge">Financial</span>', unsafe_allow_html=True)
 
     # Tree visualization
-    if st.session_state.selected_dimensions:
-        tree_data = build_hierarchy(
-            df,
-            st.session_state.selected_dimensions,
+    dimensions = tuple(st.session_state.selected_dimensions)
+    if dimensions:
+        tree_data = build_cached_hierarchy(
+            dimensions,
             selected_metric
         )
 
-        html_content = create_tree_visualization(tree_data, selected_metric)
+        # Expand/collapse state lives in the component, so reruns can reuse the rendered HTML
+        html_content = build_cached_tree_html(
+            dimensions,
+            selected_metric
+        )
         components.html(html_content, height=650, scrolling=True)
 
         # Summary metrics
         st.markdown("---")
 
-        total_value = calculate_metric(df, selected_metric)
+        # The root node already holds the metric and record count over the whole dataset
+        total_value = tree_data["value"]
         display_value = f"{total_value:.1f}%" if selected_metric == "OTP" else f"{total_value:,}"
 
         col1, col2, col3, col4 = st.columns(4)
@@ -851,9 +1042,9 @@ def main():
         with col1:
             st.metric("Total Value", display_value)
         with col2:
-            st.metric("Records", f"{len(df):,}")
+            st.metric("Records", f"{tree_data['count']:,}")
         with col3:
-            st.metric("Hierarchy Levels", len(st.session_state.selected_dimensions))
+            st.metric("Hierarchy Levels", len(dimensions))
         with col4:
             st.metric("Current Metric", selected_metric)
     else:
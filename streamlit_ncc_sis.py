@@ -8,11 +8,11 @@ import streamlit as st
 import streamlit.components.v1 as components
 
 # Local module imports
-from config import DATA_CONFIG, CORTEX_MODEL
+from config import DATA_CONFIG, CORTEX_MODEL_SUMMARY, CORTEX_MODEL_ANALYSIS
 from styles import CUSTOM_CSS, INFO_BOX_HOW_TO_USE, PERFORMANCE_LEGEND
-from data_utils import load_data, build_hierarchy, flatten_tree, get_child_nodes
-from ai_insights import generate_ai_summary, generate_child_insights, format_child_insights_html
-from tree_visualization import create_tree_html
+from data_utils import load_aggregated, filter_options, filter_data, record_count, build_filtered_tree, build_filtered_hierarchy, flatten_tree, get_child_nodes
+from ai_insights import stream_ai_summary, generate_combined_insights, format_child_insights_html
+from tree_visualization import build_filtered_tree_html
 
 # Page configuration
 st.set_page_config(
@@ -40,16 +40,136 @@ for key, default in defaults.items():
         st.session_state[key] = default
 
 
+@st.fragment
+def render_ai_panel(tree_data, filtered_df, metric_label):
+    """AI insights column; a fragment, so its widgets rerun only this panel and not the tree"""
+    st.markdown("### AI Insights")
+    st.markdown(
+        '<p style="color: #6B7280; font-size: 0.85rem; margin-bottom: 1rem;">'
+        'Select a node or double-click in the tree to analyze</p>',
+        unsafe_allow_html=True
+    )
+
+    # Node selector dropdown
+    nodes = flatten_tree(tree_data)
+    labels = [n['label'] for n in nodes]
+    selected = st.selectbox(
+        "Select segment",
+        labels,
+        help="Choose a node for AI analysis"
+    )
+    node_data = next((n['data'] for n in nodes if n['label'] == selected), None)
+    # Two levels below the selection, collected once for both the AI prompt and the breakdown
+    child_nodes = get_child_nodes(node_data, max_depth=2) if node_data and node_data.get('children') else []
+
+    # Analysis options
+    st.session_state.analyze_children = st.checkbox(
+        "Include child node analysis",
+        value=st.session_state.analyze_children,
+        help="Analyze 1-2 levels below the selected node"
+    )
+
+    # Generate insights button
+    if st.button("Generate AI Insights", type="primary", use_container_width=True):
+        with st.spinner("Analyzing with Cortex AI..."):
+            if st.session_state.analyze_children and child_nodes:
+                # Summary and child analysis share one Cortex round-trip
+                st.session_state.ai_insights, st.session_state.child_insights = generate_combined_insights(
+                    node_data,
+                    filtered_df,
+                    child_nodes,
+                    metric_label
+                )
+            else:
+                # Render the summary as it streams; the panel below shows the final text
+                placeholder = st.empty()
+                summary = ""
+                for chunk in stream_ai_summary(node_data, filtered_df, metric_label):
+                    summary += chunk
+                    placeholder.markdown(summary)
+                placeholder.empty()
+                st.session_state.ai_insights = summary
+                st.session_state.child_insights = None
+            st.session_state.selected_node = selected
+
+    # Display AI insights
+    if st.session_state.ai_insights:
+        node_name = st.session_state.selected_node.split(': ')[-1]
+        st.markdown(f"""
+        <div class="ai-insights-panel">
+            <div class="ai-insights-header">
+                <h4>{node_name}</h4>
+                <span class="ai-badge">Cortex AI</span>
+            </div>
+            <div class="ai-insights-content">
+                {st.session_state.ai_insights}
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
+
+        # Display child insights if available
+        if st.session_state.child_insights:
+            # Panel and child breakdown go out as a single markdown element. The insight
+            # text sits unindented between blank lines, which end the surrounding HTML
+            # blocks, so the model's Markdown (bold, numbered lists) is still rendered
+            parts = [
+                '<div class="ai-insights-panel" style="margin-top: 0.75rem; background: linear-gradient(135deg, #EFF6FF 0%, #DBEAFE 100%); border-color: #93C5FD;">'
+                '<div class="ai-insights-header">'
+                '<h4>Child Segment Analysis</h4>'
+                '<span class="ai-badge" style="background-color: #3B82F6;">Drill-Down</span>'
+                '</div>'
+                '<div class="ai-insights-content">\n\n',
+                st.session_state.child_insights.strip(),
+                '\n\n</div></div>\n'
+            ]
+
+            # Show child node breakdown (direct children only)
+            if child_nodes:
+                parts.append(format_child_insights_html(node_data, child_nodes))
+            st.markdown("".join(parts), unsafe_allow_html=True)
+
+    # Node details
+    if node_data:
+        st.markdown("---")
+        st.markdown("#### Selected Node Details")
+        col_a, col_b = st.columns(2)
+        with col_a:
+            value = node_data['value']
+            if value >= 1e6:
+                st.metric("Value", f"${value/1e6:.2f}M")
+            else:
+                st.metric("Value", f"${value:,.0f}")
+        with col_b:
+            st.metric("Records", f"{node_data.get('count', 0):,}")
+
+        # Show child count if applicable
+        if node_data.get('children'):
+            st.metric("Direct Children", len(node_data['children']))
+
+
 def main():
     """Main application entry point"""
-    df = load_data(DATA_CONFIG["table"])
+    # Bind the config entries used throughout the run once
+    table = DATA_CONFIG["table"]
+    metrics = DATA_CONFIG["metrics"]
+    metric_keys = list(metrics)
+    dimension_labels = DATA_CONFIG["dimension_labels"]
+
+    # One row per dimension/filter combination, aggregated in Snowflake
+    df = load_aggregated(
+        table,
+        tuple(DATA_CONFIG["dimensions"] + DATA_CONFIG["filter_columns"])
+    )
+
+    # Filter choices only change when the table is reloaded
+    options = filter_options(df, table, df.attrs['loaded_at'])
 
     # Sidebar controls
     with st.sidebar:
         st.markdown("### Settings")
 
         # Data scenario selector
-        scenarios = df['DATA_SCENARIO'].unique().tolist()
+        scenarios = options['DATA_SCENARIO']
         st.session_state.data_scenario = st.selectbox(
             "Data Scenario",
             scenarios,
@@ -62,9 +182,9 @@ def main():
         # Metric selector
         st.session_state.selected_metric = st.selectbox(
             "Metric",
-            list(DATA_CONFIG["metrics"].keys()),
-            format_func=lambda x: DATA_CONFIG["metrics"][x]["label"],
-            index=list(DATA_CONFIG["metrics"].keys()).index(st.session_state.selected_metric)
+            metric_keys,
+            format_func=lambda x: metrics[x]["label"],
+            index=metric_keys.index(st.session_state.selected_metric)
         )
 
         st.markdown("---")
@@ -75,7 +195,7 @@ def main():
             "Select drill-down levels",
             DATA_CONFIG["dimensions"],
             default=st.session_state.selected_dimensions,
-            format_func=lambda x: DATA_CONFIG["dimension_labels"].get(x, x)
+            format_func=lambda x: dimension_labels.get(x, x)
         )
         if dims:
             st.session_state.selected_dimensions = dims
@@ -84,9 +204,9 @@ def main():
 
         # Time filters
         st.markdown("### Time Filters")
-        years = sorted(df['YEAR'].unique())
+        years = options['YEAR']
         selected_years = st.multiselect("Year(s)", years, default=years)
-        months = sorted(df['MONTH_OF_YEAR'].unique())
+        months = options['MONTH_OF_YEAR']
         selected_months = st.multiselect("Month(s)", months, default=months)
 
         st.markdown("---")
@@ -98,23 +218,24 @@ def main():
         # Model info
         st.markdown(f"""
         <div class="info-box">
-            <h4>AI Model</h4>
-            <p>{CORTEX_MODEL}</p>
+            <h4>AI Models</h4>
+            <p>Summary: {CORTEX_MODEL_SUMMARY}<br>Analysis: {CORTEX_MODEL_ANALYSIS}</p>
         </div>
         """, unsafe_allow_html=True)
 
+    # Bind the settings chosen above once for the rest of the run
+    scenario = st.session_state.data_scenario
+    metric = st.session_state.selected_metric
+    dimensions = tuple(st.session_state.selected_dimensions)
+
     # Filter data
-    filtered_df = df[
-        (df['DATA_SCENARIO'] == st.session_state.data_scenario) &
-        (df['YEAR'].isin(selected_years)) &
-        (df['MONTH_OF_YEAR'].isin(selected_months))
-    ]
+    filtered_df = filter_data(df, scenario, selected_years, selected_months)
 
     # Header section
     st.title("NCC Decomposition Tree")
-    metric_label = DATA_CONFIG["metrics"][st.session_state.selected_metric]["label"]
+    metric_label = metrics[metric]["label"]
     st.markdown(
-        f'<p class="subtitle">Analyzing {metric_label} | Scenario: {st.session_state.data_scenario}</p>',
+        f'<p class="subtitle">Analyzing {metric_label} | Scenario: {scenario}</p>',
         unsafe_allow_html=True
     )
     st.markdown('<span class="category-badge">Financial</span>', unsafe_allow_html=True)
@@ -128,128 +249,41 @@ def main():
     c1.metric("Total NCC", f"${total_ncc/1e6:.1f}M")
     c2.metric("Prior Year", f"${total_py/1e6:.1f}M")
     c3.metric("YoY Growth", f"{yoy:+.1f}%")
-    c4.metric("Records", f"{len(filtered_df):,}")
-    c5.metric("Drill Levels", len(st.session_state.selected_dimensions))
+    c4.metric("Records", f"{record_count(filtered_df):,}")
+    c5.metric("Drill Levels", len(dimensions))
 
     st.markdown("---")
 
     # Main content area
-    if st.session_state.selected_dimensions and len(filtered_df) > 0:
-        tree_data = build_hierarchy(
+    if dimensions and len(filtered_df) > 0:
+        filter_key = (
+            table,
+            df.attrs['loaded_at'],
+            scenario,
+            tuple(selected_years),
+            tuple(selected_months)
+        )
+        tree = build_filtered_tree(
             filtered_df,
-            st.session_state.selected_dimensions,
-            st.session_state.selected_metric
+            filter_key,
+            dimensions,
+            metric
         )
+        # The component is encoded from the arrays; the AI panel walks nested dicts
+        tree_data = build_filtered_hierarchy(tree, filter_key, dimensions, metric)
 
         tree_col, ai_col = st.columns([2, 1])
 
         with tree_col:
             # Tree visualization with larger size
             components.html(
-                create_tree_html(tree_data, st.session_state.selected_metric),
+                build_filtered_tree_html(tree, filter_key, dimensions, metric),
                 height=750,
                 scrolling=True
             )
 
         with ai_col:
-            st.markdown("### AI Insights")
-            st.markdown(
-                '<p style="color: #6B7280; font-size: 0.85rem; margin-bottom: 1rem;">'
-                'Select a node or double-click in the tree to analyze</p>',
-                unsafe_allow_html=True
-            )
-
-            # Node selector dropdown
-            nodes = flatten_tree(tree_data)
-            labels = [n['label'] for n in nodes]
-            selected = st.selectbox(
-                "Select segment",
-                labels,
-                help="Choose a node for AI analysis"
-            )
-            node_data = next((n['data'] for n in nodes if n['label'] == selected), None)
-
-            # Analysis options
-            st.session_state.analyze_children = st.checkbox(
-                "Include child node analysis",
-                value=st.session_state.analyze_children,
-                help="Analyze 1-2 levels below the selected node"
-            )
-
-            # Generate insights button
-            if st.button("Generate AI Insights", type="primary", use_container_width=True):
-                with st.spinner("Analyzing with Cortex AI..."):
-                    # Generate main summary
-                    st.session_state.ai_insights = generate_ai_summary(
-                        node_data,
-                        filtered_df,
-                        metric_label
-                    )
-                    st.session_state.selected_node = selected
-
-                    # Generate child insights if enabled
-                    if st.session_state.analyze_children and node_data.get('children'):
-                        child_nodes = get_child_nodes(node_data, max_depth=2)
-                        st.session_state.child_insights = generate_child_insights(
-                            node_data,
-                            child_nodes,
-                            metric_label
-                        )
-                    else:
-                        st.session_state.child_insights = None
-
-            # Display AI insights
-            if st.session_state.ai_insights:
-                node_name = st.session_state.selected_node.split(': ')[-1]
-                st.markdown(f"""
-                <div class="ai-insights-panel">
-                    <div class="ai-insights-header">
-                        <h4>{node_name}</h4>
-                        <span class="ai-badge">Cortex AI</span>
-                    </div>
-                    <div class="ai-insights-content">
-                        {st.session_state.ai_insights}
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
-
-                # Display child insights if available
-                if st.session_state.child_insights:
-                    st.markdown("""
-                    <div class="ai-insights-panel" style="margin-top: 0.75rem; background: linear-gradient(135deg, #EFF6FF 0%, #DBEAFE 100%); border-color: #93C5FD;">
-                        <div class="ai-insights-header">
-                            <h4>Child Segment Analysis</h4>
-                            <span class="ai-badge" style="background-color: #3B82F6;">Drill-Down</span>
-                        </div>
-                        <div class="ai-insights-content">
-                    """, unsafe_allow_html=True)
-                    st.markdown(st.session_state.child_insights)
-                    st.markdown("</div></div>", unsafe_allow_html=True)
-
-                    # Show child node breakdown
-                    if node_data and node_data.get('children'):
-                        child_nodes = get_child_nodes(node_data, max_depth=1)
-                        child_html = format_child_insights_html(node_data, child_nodes)
-                        if child_html:
-                            st.markdown(child_html, unsafe_allow_html=True)
-
-            # Node details
-            if node_data:
-                st.markdown("---")
-                st.markdown("#### Selected Node Details")
-                col_a, col_b = st.columns(2)
-                with col_a:
-                    value = node_data['value']
-                    if value >= 1e6:
-                        st.metric("Value", f"${value/1e6:.2f}M")
-                    else:
-                        st.metric("Value", f"${value:,.0f}")
-                with col_b:
-                    st.metric("Records", f"{node_data.get('count', 0):,}")
-
-                # Show child count if applicable
-                if node_data.get('children'):
-                    st.metric("Direct Children", len(node_data['children']))
+            render_ai_panel(tree_data, filtered_df, metric_label)
     else:
         st.warning("Select at least one dimension and ensure data is available.")
 
@@ -0,0 +1,324 @@
+"""
+Unit tests for NCC AI insights
+Tests the COMPLETE query, combined-response parsing, the Cortex call fallbacks and streamed-summary reuse with mocked Cortex calls
+"""
+
+import json
+import threading
+import pytest
+import pandas as pd
+
+# Import functions from the AI module (without Streamlit or Snowflake)
+import sys
+from unittest.mock import MagicMock
+
+# Mock streamlit and snowpark before importing
+mock_st = MagicMock()
+
+
+def passthrough_cache(func=None, **kwargs):
+    """Passthrough for both @st.cache_data and @st.cache_data(...)"""
+    return func if func is not None else (lambda f: f)
+
+
+mock_st.cache_data = passthrough_cache
+mock_st.cache_resource = passthrough_cache
+sys.modules['streamlit'] = mock_st
+sys.modules['snowflake'] = MagicMock()
+sys.modules['snowflake.snowpark'] = MagicMock()
+sys.modules['snowflake.snowpark.context'] = MagicMock()
+
+import ai_insights
+from ai_insights import (
+    _cached_complete,
+    _parse_combined_response,
+    _request,
+    generate_combined_insights,
+    stream_ai_summary,
+    COMBINED_INSIGHTS_INSTRUCTIONS,
+    SUMMARY_INSTRUCTIONS,
+    CHILD_INSIGHTS_INSTRUCTIONS
+)
+
+
+# ============================================
+# FIXTURES
+# ============================================
+
+@pytest.fixture
+def node_data():
+    """A segment with two direct children"""
+    return {
+        'name': 'East',
+        'dimension': 'REGION',
+        'value': 3e6,
+        'count': 120,
+        'children': [
+            {'name': 'S1', 'dimension': 'SYSTEM', 'value': 2e6, 'count': 80},
+            {'name': 'S2', 'dimension': 'SYSTEM', 'value': 1e6, 'count': 40}
+        ]
+    }
+
+
+@pytest.fixture
+def child_nodes(node_data):
+    """Child nodes in the shape get_child_nodes produces"""
+    return [{**c, 'depth': 1} for c in node_data['children']]
+
+
+@pytest.fixture
+def filtered_df():
+    """Filtered frame used for the year-over-year line"""
+    return pd.DataFrame({'NCC': [3e6], 'NCC_PY': [2.5e6]})
+
+
+@pytest.fixture
+def cortex(monkeypatch):
+    """Replace _complete with a stub that answers by prompt and records which prompts were sent"""
+    calls = []
+    replies = {
+        SUMMARY_INSTRUCTIONS: "Summary only.",
+        CHILD_INSIGHTS_INSTRUCTIONS: "Children only."
+    }
+
+    def fake_complete(model, instructions, segment_stats, max_tokens=None):
+        calls.append(instructions)
+        reply = replies[instructions]
+        return reply() if callable(reply) else reply
+
+    monkeypatch.setattr(ai_insights, "_complete", fake_complete)
+    return replies, calls
+
+
+# ============================================
+# CORTEX CALL TESTS
+# ============================================
+
+class TestCachedComplete:
+    """Tests for _cached_complete function"""
+
+    @pytest.fixture
+    def session(self, monkeypatch):
+        """Replace the Snowpark session with a mock whose query returns the rows set on it"""
+        session = MagicMock()
+        monkeypatch.setattr(ai_insights, "get_active_session", lambda: session)
+        return session
+
+    def test_message_list_response(self, session):
+        """The text is read from the COMPLETE JSON document"""
+        session.sql.return_value.collect.return_value = [{'RESPONSE': json.dumps({
+            "choices": [{"messages": "Strong quarter."}],
+            "created": 1718000000,
+            "model": "mistral-large2",
+            "usage": {"completion_tokens": 3, "prompt_tokens": 120, "total_tokens": 123}
+        })}]
+        request = _request("mistral-large2", SUMMARY_INSTRUCTIONS, "Segment: East")
+        assert _cached_complete(*request) == "Strong quarter."
+        session.sql.assert_called_once_with(
+            "SELECT SNOWFLAKE.CORTEX.COMPLETE(?, PARSE_JSON(?), PARSE_JSON(?)) as response",
+            params=list(request)
+        )
+        model, messages_json, options_json = session.sql.call_args.kwargs["params"]
+        assert [m["role"] for m in json.loads(messages_json)] == ["system", "user"]
+        assert "max_tokens" in json.loads(options_json)
+
+    def test_no_rows(self, session):
+        """An empty result is reported, not indexed"""
+        session.sql.return_value.collect.return_value = []
+        request = _request("mistral-large2", SUMMARY_INSTRUCTIONS, "Segment: East")
+        assert _cached_complete(*request) == "No response generated"
+
+    def test_null_response(self, session):
+        """A NULL response column is reported, not parsed"""
+        session.sql.return_value.collect.return_value = [{'RESPONSE': None}]
+        request = _request("mistral-large2", SUMMARY_INSTRUCTIONS, "Segment: East")
+        assert _cached_complete(*request) == "No response generated"
+
+
+# ============================================
+# RESPONSE PARSING TESTS
+# ============================================
+
+class TestParseCombinedResponse:
+    """Tests for _parse_combined_response function"""
+
+    def test_plain_json(self):
+        """Both parts are read from a bare JSON object"""
+        response = '{"summary": "S", "child_insights": "C"}'
+        assert _parse_combined_response(response) == ("S", "C")
+
+    def test_fenced_json(self):
+        """Code fences and surrounding prose are ignored"""
+        response = 'Here you go:\n```json\n{"summary": "S", "child_insights": "C"}\n```'
+        assert _parse_combined_response(response) == ("S", "C")
+
+    def test_no_braces(self):
+        """Plain prose yields neither part"""
+        assert _parse_combined_response("The segment performed well.") == (None, None)
+
+    def test_json_list(self):
+        """A JSON list is not the requested object"""
+        assert _parse_combined_response('["S", "C"]') == (None, None)
+
+    def test_list_of_objects(self):
+        """Several objects in a list do not parse as one object"""
+        response = '[{"summary": "S"}, {"child_insights": "C"}]'
+        assert _parse_combined_response(response) == (None, None)
+
+    def test_missing_child_insights(self):
+        """The summary is kept when the child analysis is missing"""
+        assert _parse_combined_response('{"summary": "S"}') == ("S", None)
+
+    def test_missing_summary(self):
+        """The child analysis is kept when the summary is missing"""
+        assert _parse_combined_response('{"child_insights": "C"}') == (None, "C")
+
+    def test_non_text_parts(self):
+        """Objects, lists and numbers in place of text count as missing"""
+        response = '{"summary": {"text": "S"}, "child_insights": ["C1", "C2"]}'
+        assert _parse_combined_response(response) == (None, None)
+        assert _parse_combined_response('{"summary": "S", "child_insights": 3}') == ("S", None)
+
+
+# ============================================
+# COMBINED INSIGHTS TESTS
+# ============================================
+
+class TestGenerateCombinedInsights:
+    """Tests for generate_combined_insights function"""
+
+    def test_single_call(self, cortex, node_data, child_nodes, filtered_df):
+        """A well-formed reply costs exactly one Cortex call"""
+        replies, calls = cortex
+        replies[COMBINED_INSIGHTS_INSTRUCTIONS] = '{"summary": "S", "child_insights": "C"}'
+        result = generate_combined_insights(node_data, filtered_df, child_nodes, "NCC")
+        assert result == ("S", "C")
+        assert calls == [COMBINED_INSIGHTS_INSTRUCTIONS]
+
+    def test_missing_child_insights_keeps_summary(self, cortex, node_data, child_nodes, filtered_df):
+        """Only the child analysis is re-requested when the summary came back"""
+        replies, calls = cortex
+        replies[COMBINED_INSIGHTS_INSTRUCTIONS] = '{"summary": "S"}'
+        result = generate_combined_insights(node_data, filtered_df, child_nodes, "NCC")
+        assert result == ("S", "Children only.")
+        assert calls == [COMBINED_INSIGHTS_INSTRUCTIONS, CHILD_INSIGHTS_INSTRUCTIONS]
+
+    def test_missing_summary_keeps_child_insights(self, cortex, node_data, child_nodes, filtered_df):
+        """Only the summary is re-requested when the child analysis came back"""
+        replies, calls = cortex
+        replies[COMBINED_INSIGHTS_INSTRUCTIONS] = '{"child_insights": "C"}'
+        result = generate_combined_insights(node_data, filtered_df, child_nodes, "NCC")
+        assert result == ("Summary only.", "C")
+        assert calls == [COMBINED_INSIGHTS_INSTRUCTIONS, SUMMARY_INSTRUCTIONS]
+
+    def test_non_text_summary_is_re_requested(self, cortex, node_data, child_nodes, filtered_df):
+        """A summary that is not text is treated as missing rather than displayed"""
+        replies, calls = cortex
+        replies[COMBINED_INSIGHTS_INSTRUCTIONS] = '{"summary": {"text": "S"}, "child_insights": "C"}'
+        result = generate_combined_insights(node_data, filtered_df, child_nodes, "NCC")
+        assert result == ("Summary only.", "C")
+        assert calls == [COMBINED_INSIGHTS_INSTRUCTIONS, SUMMARY_INSTRUCTIONS]
+
+    def test_unparseable_falls_back_concurrently(self, cortex, node_data, child_nodes, filtered_df):
+        """Both fallback prompts are in flight at the same time"""
+        replies, calls = cortex
+        replies[COMBINED_INSIGHTS_INSTRUCTIONS] = "Not JSON at all."
+        # Each fallback call waits for the other; run one after the other, the barrier times out
+        barrier = threading.Barrier(2, timeout=5)
+
+        def wait_then(text):
+            def reply():
+                barrier.wait()
+                return text
+            return reply
+
+        replies[SUMMARY_INSTRUCTIONS] = wait_then("Summary only.")
+        replies[CHILD_INSIGHTS_INSTRUCTIONS] = wait_then("Children only.")
+        result = generate_combined_insights(node_data, filtered_df, child_nodes, "NCC")
+        assert result == ("Summary only.", "Children only.")
+        assert calls[0] == COMBINED_INSIGHTS_INSTRUCTIONS
+        assert sorted(calls[1:]) == sorted([SUMMARY_INSTRUCTIONS, CHILD_INSIGHTS_INSTRUCTIONS])
+
+    def test_no_children_summary_only(self, cortex, node_data, filtered_df):
+        """Leaf segments skip the combined prompt"""
+        replies, calls = cortex
+        result = generate_combined_insights(node_data, filtered_df, [], "NCC")
+        assert result == ("Summary only.", None)
+        assert calls == [SUMMARY_INSTRUCTIONS]
+
+    def test_cortex_error(self, cortex, node_data, child_nodes, filtered_df):
+        """A failed call is reported instead of raised"""
+        replies, calls = cortex
+
+        def fail():
+            raise RuntimeError("warehouse suspended")
+
+        replies[COMBINED_INSIGHTS_INSTRUCTIONS] = fail
+        summary, child_insights = generate_combined_insights(node_data, filtered_df, child_nodes, "NCC")
+        assert "warehouse suspended" in summary
+        assert child_insights is None
+
+
+# ============================================
+# STREAMED SUMMARY TESTS
+# ============================================
+
+class TestStreamAiSummary:
+    """Tests for stream_ai_summary function"""
+
+    @pytest.fixture
+    def streaming(self, monkeypatch):
+        """Stub the streaming Cortex client and give the module a fresh session state"""
+        calls = []
+
+        def fake_stream(model, messages, options=None, session=None, stream=False):
+            calls.append(messages)
+            yield "Strong "
+            yield "quarter."
+
+        monkeypatch.setattr(ai_insights, "cortex_complete", fake_stream)
+        monkeypatch.setattr(ai_insights.st, "session_state", {})
+        return calls
+
+    def test_streams_chunks(self, streaming, node_data, filtered_df):
+        """The first request streams chunk by chunk"""
+        assert list(stream_ai_summary(node_data, filtered_df, "NCC")) == ["Strong ", "quarter."]
+        assert len(streaming) == 1
+
+    def test_repeat_replays_stored_text(self, streaming, node_data, filtered_df):
+        """The same node again is served from session state without another call"""
+        list(stream_ai_summary(node_data, filtered_df, "NCC"))
+        assert list(stream_ai_summary(node_data, filtered_df, "NCC")) == ["Strong quarter."]
+        assert len(streaming) == 1
+
+    def test_different_node_streams_again(self, streaming, node_data, filtered_df):
+        """A different segment is a different prompt"""
+        list(stream_ai_summary(node_data, filtered_df, "NCC"))
+        list(stream_ai_summary({**node_data, 'name': 'West'}, filtered_df, "NCC"))
+        assert len(streaming) == 2
+
+    def test_oldest_summary_evicted(self, streaming, node_data, filtered_df, monkeypatch):
+        """Past the limit the least recently used summary is dropped"""
+        monkeypatch.setattr(ai_insights, "MAX_STORED_SUMMARIES", 2)
+        east, west, north = node_data, {**node_data, 'name': 'West'}, {**node_data, 'name': 'North'}
+        for node in (east, west, east, north):
+            list(stream_ai_summary(node, filtered_df, "NCC"))
+        # East was replayed after West, so West was the one dropped for North
+        assert len(ai_insights.st.session_state['summary_completions']) == 2
+        assert len(streaming) == 3
+        list(stream_ai_summary(east, filtered_df, "NCC"))
+        assert len(streaming) == 3
+        list(stream_ai_summary(west, filtered_df, "NCC"))
+        assert len(streaming) == 4
+
+    def test_errors_are_not_stored(self, monkeypatch, node_data, filtered_df):
+        """A failed stream is retried on the next request"""
+        def failing_stream(*args, **kwargs):
+            raise RuntimeError("timeout")
+            yield
+
+        monkeypatch.setattr(ai_insights, "cortex_complete", failing_stream)
+        monkeypatch.setattr(ai_insights.st, "session_state", {})
+        first = list(stream_ai_summary(node_data, filtered_df, "NCC"))
+        assert "timeout" in first[0]
+        assert ai_insights.st.session_state['summary_completions'] == {}
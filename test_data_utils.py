@@ -0,0 +1,296 @@
+"""
+Unit tests for NCC data utilities
+Checks the NumPy tree builder against the original recursive builder, and the scenario/time filter
+"""
+
+import math
+import pytest
+import pandas as pd
+import numpy as np
+
+# Import functions from the data module (without Streamlit or Snowflake)
+import sys
+from unittest.mock import MagicMock
+
+# Mock streamlit and snowpark before importing
+mock_st = MagicMock()
+
+
+def passthrough_cache(func=None, **kwargs):
+    """Passthrough for both @st.cache_data and @st.cache_data(...)"""
+    return func if func is not None else (lambda f: f)
+
+
+mock_st.cache_data = passthrough_cache
+mock_st.cache_resource = passthrough_cache
+sys.modules['streamlit'] = mock_st
+sys.modules['snowflake'] = MagicMock()
+sys.modules['snowflake.snowpark'] = MagicMock()
+sys.modules['snowflake.snowpark.context'] = MagicMock()
+
+from data_utils import (
+    _categorize_dimensions,
+    build_hierarchy,
+    build_tree_soa,
+    filter_data,
+    get_color
+)
+
+DIMENSIONS = ["REGION", "SYSTEM", "PROFIT_CENTER", "PRACTICE_AREA"]
+METRICS = ["NCC", "NCC_PY", "YoY_Growth", "Avg_NCC"]
+
+
+# ============================================
+# REFERENCE IMPLEMENTATION
+# ============================================
+
+def reference_calculate_metric(df: pd.DataFrame, metric: str) -> float:
+    """Original per-group metric on raw rows"""
+    if len(df) == 0:
+        return 0.0
+    if metric == "NCC":
+        return round(df['NCC'].sum(), 2)
+    elif metric == "NCC_PY":
+        return round(df['NCC_PY'].sum(), 2)
+    elif metric == "YoY_Growth":
+        ncc, ncc_py = df['NCC'].sum(), df['NCC_PY'].sum()
+        return round(((ncc - ncc_py) / ncc_py) * 100, 1) if ncc_py != 0 else 0.0
+    elif metric == "Avg_NCC":
+        return round(df['NCC'].mean(), 2)
+    return 0.0
+
+
+def reference_build_hierarchy(df: pd.DataFrame, dimensions, metric: str) -> dict:
+    """Original recursive builder: one groupby and one DataFrame per node"""
+    def build_level(data, dims_remaining):
+        if not dims_remaining or len(data) == 0:
+            return []
+        current_dim, next_dims = dims_remaining[0], dims_remaining[1:]
+        groups = list(data.groupby(current_dim))
+        values = [reference_calculate_metric(group, metric) for _, group in groups]
+        min_val, max_val = (min(values), max(values)) if values else (0, 1)
+        children = []
+        for (name, group), value in zip(groups, values):
+            node = {
+                "name": str(name),
+                "dimension": current_dim,
+                "value": value,
+                "color": get_color(value, min_val, max_val, metric),
+                "count": len(group)
+            }
+            if next_dims:
+                node["children"] = build_level(group, next_dims)
+            children.append(node)
+        return sorted(children, key=lambda x: x["value"], reverse=True)
+
+    return {
+        "name": "Total NCC",
+        "dimension": "Total",
+        "value": reference_calculate_metric(df, metric),
+        "color": "#1B5E3F",
+        "count": len(df),
+        "children": build_level(df, dimensions)
+    }
+
+
+# ============================================
+# HELPERS
+# ============================================
+
+def make_raw(seed: int, n: int = 400, nan_keys: bool = False) -> pd.DataFrame:
+    """Random raw rows; whole-dollar NCC so sums are exact in any order"""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'REGION': rng.choice(['East', 'West', 'North'], n),
+        'SYSTEM': rng.choice(['S1', 'S2', 'S3', 'S4'], n),
+        'PROFIT_CENTER': rng.choice([f'PC{i}' for i in range(5)], n),
+        'PRACTICE_AREA': rng.choice(['Tax', 'Audit', 'Advisory'], n),
+        'YEAR': rng.choice([2023, 2024], n),
+        'NCC': rng.integers(-2000, 50000, n).astype(float),
+        'NCC_PY': rng.integers(0, 40000, n).astype(float)
+    })
+    if nan_keys:
+        df.loc[rng.random(n) < 0.05, 'SYSTEM'] = np.nan
+        df.loc[rng.random(n) < 0.05, 'PRACTICE_AREA'] = np.nan
+    return df
+
+
+def aggregate(df: pd.DataFrame) -> pd.DataFrame:
+    """What load_aggregated's GROUP BY returns: NULL keys kept, SUM of all-NULL is NULL"""
+    grouped = df.groupby(DIMENSIONS + ['YEAR'], dropna=False)
+    return _categorize_dimensions(pd.DataFrame({
+        'NCC': grouped['NCC'].sum(min_count=1),
+        'NCC_PY': grouped['NCC_PY'].sum(min_count=1),
+        'NCC_COUNT': grouped['NCC'].count(),
+        'RECORD_COUNT': grouped.size()
+    }).reset_index())
+
+
+def same_value(a: float, b: float) -> bool:
+    return a == b or (math.isnan(a) and math.isnan(b))
+
+
+def assert_same_tree(new: dict, old: dict, path: str = "") -> None:
+    """Compare trees node by node.
+
+    The original builder sorts and takes min/max with NaN values in the list, where the result
+    depends on where the NaN lands; sibling sets containing NaN are matched by name and their
+    colors are not compared.
+    """
+    here = f"{path}/{old['name']}"
+    for key in ("name", "dimension", "count"):
+        assert new[key] == old[key], f"{here}: {key}"
+    assert same_value(new["value"], old["value"]), f"{here}: value {new['value']} != {old['value']}"
+    assert ("children" in new) == ("children" in old), f"{here}: children key"
+    new_children, old_children = new.get("children", []), old.get("children", [])
+    if any(math.isnan(c["value"]) for c in old_children):
+        by_name = {c["name"]: c for c in old_children}
+        assert sorted(by_name) == sorted(c["name"] for c in new_children), f"{here}: children"
+        for child in new_children:
+            assert_same_tree({**child, "color": None}, {**by_name[child["name"]], "color": None}, here)
+        return
+    assert new["color"] == old["color"], f"{here}: color"
+    assert [c["name"] for c in new_children] == [c["name"] for c in old_children], f"{here}: order"
+    for new_child, old_child in zip(new_children, old_children):
+        assert_same_tree(new_child, old_child, here)
+
+
+# ============================================
+# TREE BUILDER EQUIVALENCE TESTS
+# ============================================
+
+class TestBuildHierarchyEquivalence:
+    """build_hierarchy must match the original recursive builder"""
+
+    @pytest.mark.parametrize("metric", METRICS)
+    @pytest.mark.parametrize("seed", range(5))
+    def test_raw_rows(self, seed, metric):
+        """Raw object-dtype rows"""
+        df = make_raw(seed)
+        assert_same_tree(build_hierarchy(df, DIMENSIONS, metric), reference_build_hierarchy(df, DIMENSIONS, metric))
+
+    @pytest.mark.parametrize("metric", METRICS)
+    @pytest.mark.parametrize("seed", range(5))
+    def test_categorical_rows(self, seed, metric):
+        """Raw rows with category dimensions"""
+        df = make_raw(seed)
+        expected = reference_build_hierarchy(df, DIMENSIONS, metric)
+        assert_same_tree(build_hierarchy(_categorize_dimensions(df.copy()), DIMENSIONS, metric), expected)
+
+    @pytest.mark.parametrize("metric", METRICS)
+    @pytest.mark.parametrize("seed", range(5))
+    def test_pre_aggregated(self, seed, metric):
+        """Snowflake-aggregated rows give the same tree as the raw rows they came from"""
+        df = make_raw(seed)
+        expected = reference_build_hierarchy(df, DIMENSIONS, metric)
+        assert_same_tree(build_hierarchy(aggregate(df), DIMENSIONS, metric), expected)
+
+    @pytest.mark.parametrize("metric", METRICS)
+    @pytest.mark.parametrize("seed", range(3))
+    def test_nan_dimension_keys(self, seed, metric):
+        """Rows with a missing key are dropped together with everything below them"""
+        df = make_raw(seed, nan_keys=True)
+        expected = reference_build_hierarchy(df, DIMENSIONS, metric)
+        assert_same_tree(build_hierarchy(df, DIMENSIONS, metric), expected)
+        assert_same_tree(build_hierarchy(aggregate(df), DIMENSIONS, metric), expected)
+
+    def test_dimension_subset(self):
+        """Fewer, reordered dimensions"""
+        df = make_raw(7)
+        dims = ["PRACTICE_AREA", "REGION"]
+        expected = reference_build_hierarchy(df, dims, "NCC")
+        assert_same_tree(build_hierarchy(df, dims, "NCC"), expected)
+        assert_same_tree(build_hierarchy(aggregate(df), dims, "NCC"), expected)
+
+    @pytest.mark.parametrize("metric", METRICS)
+    def test_value_ties_keep_key_order(self, metric):
+        """Siblings with equal values come out in key order, not first-appearance order"""
+        df = make_raw(0, n=12)
+        df['NCC'], df['NCC_PY'] = 100.0, 80.0
+        df['SYSTEM'] = ['S3', 'S1', 'S2', 'S4'] * 3
+        expected = reference_build_hierarchy(df, DIMENSIONS, metric)
+        assert_same_tree(build_hierarchy(df, DIMENSIONS, metric), expected)
+        assert_same_tree(build_hierarchy(aggregate(df), DIMENSIONS, metric), expected)
+
+    def test_avg_ncc_all_missing_group(self):
+        """Avg_NCC of a group whose NCC values are all missing (NCC_COUNT == 0)"""
+        df = make_raw(11)
+        df.loc[df['PROFIT_CENTER'].isin(['PC1', 'PC3']), 'NCC'] = np.nan
+        expected = reference_build_hierarchy(df, DIMENSIONS, "Avg_NCC")
+        aggregated = aggregate(df)
+        assert (aggregated['NCC_COUNT'] == 0).any()
+        for tree in (build_hierarchy(df, DIMENSIONS, "Avg_NCC"), build_hierarchy(aggregated, DIMENSIONS, "Avg_NCC")):
+            assert_same_tree(tree, expected)
+            # Missing averages sort after every real value and are colored as the lowest band
+            centers = tree["children"][0]["children"][0]["children"]
+            values = [c["value"] for c in centers]
+            assert [math.isnan(v) for v in values] == [False, False, False, True, True]
+            assert values[:3] == sorted(values[:3], reverse=True)
+            assert {c["color"] for c in centers[3:]} == {"#DC2626"}
+            assert centers[0]["color"] == "#1B5E3F"
+
+    def test_avg_ncc_all_missing_bars(self):
+        """Missing averages get an empty bar and do not disturb their siblings' bars"""
+        df = make_raw(11)
+        df.loc[df['PROFIT_CENTER'].isin(['PC1', 'PC3']), 'NCC'] = np.nan
+        tree = build_tree_soa(aggregate(df), DIMENSIONS, "Avg_NCC")
+        assert np.isfinite(tree.bars).all()
+        assert (tree.bars[np.isnan(tree.values)] == 0).all()
+        assert tree.bars.min() >= 0 and tree.bars.max() == 1
+
+
+# ============================================
+# FILTER TESTS
+# ============================================
+
+@pytest.fixture
+def scenario_df():
+    """Two scenarios across two years and months"""
+    return pd.DataFrame({
+        'DATA_SCENARIO': ['Actuals', 'Actuals', 'Budget', 'Actuals', 'Budget'],
+        'YEAR': [2023, 2024, 2024, 2024, 2023],
+        'MONTH_OF_YEAR': [1, 1, 2, 2, 1],
+        'NCC': [1.0, 2.0, 3.0, 4.0, 5.0]
+    })
+
+
+class TestFilterData:
+    """Tests for filter_data function"""
+
+    def test_scenario_year_month(self, scenario_df):
+        """All three filters apply together"""
+        result = filter_data(scenario_df, 'Actuals', [2024], [1, 2])
+        assert result['NCC'].tolist() == [2.0, 4.0]
+
+    def test_month_filter(self, scenario_df):
+        """Unselected months are dropped"""
+        result = filter_data(scenario_df, 'Actuals', [2023, 2024], [2])
+        assert result['NCC'].tolist() == [4.0]
+
+    def test_no_match(self, scenario_df):
+        """No matching rows gives an empty frame with the same columns"""
+        result = filter_data(scenario_df, 'Forecast', [2023, 2024], [1, 2])
+        assert len(result) == 0
+        assert list(result.columns) == list(scenario_df.columns)
+
+    def test_all_rows_returns_input_uncopied(self):
+        """When every row matches, the input frame itself is returned"""
+        df = pd.DataFrame({
+            'DATA_SCENARIO': ['Actuals', 'Actuals'],
+            'YEAR': [2024, 2024],
+            'MONTH_OF_YEAR': [1, 2],
+            'NCC': [1.0, 2.0]
+        })
+        assert filter_data(df, 'Actuals', [2024], [1, 2]) is df
+
+    def test_partial_match_is_new_frame(self, scenario_df):
+        """A real filter never hands back the input"""
+        result = filter_data(scenario_df, 'Actuals', [2023, 2024], [1, 2])
+        assert result is not scenario_df
+        assert len(scenario_df) == 5
+
+    def test_categorical_scenario(self, scenario_df):
+        """Scenario stored as category compares the same as strings"""
+        scenario_df['DATA_SCENARIO'] = scenario_df['DATA_SCENARIO'].astype('category')
+        result = filter_data(scenario_df, 'Budget', [2023, 2024], [1, 2])
+        assert result['NCC'].tolist() == [3.0, 5.0]
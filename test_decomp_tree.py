@@ -6,6 +6,7 @@ Tests data processing, hierarchy building, and metric calculations
 import pytest
 import pandas as pd
 import numpy as np
+import base64
 import json
 
 # Import functions from main app (without running Streamlit)
@@ -14,20 +15,31 @@ from unittest.mock import MagicMock
 
 # Mock streamlit before importing
 mock_st = MagicMock()
-# Make cache_data a passthrough decorator
-mock_st.cache_data = lambda func: func
+
+
+def passthrough_cache(func=None, **kwargs):
+    """Passthrough for both @st.cache_data and @st.cache_data(...)"""
+    return func if func is not None else (lambda f: f)
+
+
+# Make cache_data and cache_resource passthrough decorators
+mock_st.cache_data = passthrough_cache
+mock_st.cache_resource = passthrough_cache
 mock_st.set_page_config = MagicMock()
 sys.modules['streamlit'] = mock_st
 sys.modules['streamlit.components'] = MagicMock()
 sys.modules['streamlit.components.v1'] = MagicMock()
 
 # Now we can import our functions
+import streamlit_app
 from streamlit_app import (
     calculate_metric,
     get_color,
     build_hierarchy,
     create_tree_visualization,
-    generate_mock_data
+    encode_tree,
+    generate_mock_data,
+    pack_uints
 )
 
 
@@ -341,6 +353,148 @@ class TestCreateTreeVisualization:
 
         assert '"use strict"' in result
 
+    @pytest.mark.parametrize("metric", ["OTP", "Trips"])
+    def test_serializers_agree(self, sample_df, metric, monkeypatch):
+        """orjson and the standard library fallback produce the same page"""
+        pytest.importorskip("orjson")
+        df = sample_df.assign(Division=['Zürich', 'Zürich', 'Manhattan </script>', 'Manhattan </script>', 'Bronx'])
+        df.loc[4, 'OTP'] = np.nan
+        tree_data = build_hierarchy(df, ["Division", "Depot"], metric)
+        with_orjson = create_tree_visualization(tree_data, metric)
+        monkeypatch.setattr(streamlit_app, "orjson", None)
+        assert create_tree_visualization(tree_data, metric) == with_orjson
+        assert "Manhattan </script>" not in with_orjson
+        assert "NaN" not in with_orjson
+
+
+# ============================================
+# PAYLOAD ENCODING TESTS
+# ============================================
+
+def unpack(column):
+    """Decode a pack_uints column the way the component's unpack() does"""
+    return np.frombuffer(base64.b64decode(column["b64"]), dtype="<" + column["type"]).tolist()
+
+
+def decode_payload(payload):
+    """Rebuild the nested tree from encode_tree's breadth-first columns"""
+    columns = {key: unpack(payload[key]) for key in ("name", "dimension", "color", "bar", "nChildren")}
+    nodes = [{
+        "name": payload["names"][columns["name"][i]],
+        "dimension": payload["dims"][columns["dimension"][i]],
+        "value": value,
+        "color": payload["colors"][columns["color"][i]],
+        "count": payload["count"][i],
+        "bar": columns["bar"][i] / 1000
+    } for i, value in enumerate(payload["value"])]
+    next_child = 1
+    for node, n_children in zip(nodes, columns["nChildren"]):
+        node["children"] = nodes[next_child:next_child + n_children]
+        next_child += n_children
+    return nodes[0]
+
+
+def assert_same_tree(decoded, original):
+    """Compare a decoded tree with the original; a missing children key means no children"""
+    for key in ("name", "dimension", "value", "color", "count"):
+        assert decoded[key] == original[key]
+    assert decoded["bar"] == pytest.approx(original["bar"], abs=1e-9)
+    children = original.get("children", [])
+    assert len(decoded["children"]) == len(children)
+    for decoded_child, child in zip(decoded["children"], children):
+        assert_same_tree(decoded_child, child)
+
+
+class TestPackUints:
+    """Tests for pack_uints function"""
+
+    def test_u1(self):
+        """Values below 256 fit one byte each"""
+        packed = pack_uints([0, 7, 255])
+        assert packed["type"] == "u1"
+        assert unpack(packed) == [0, 7, 255]
+
+    def test_u1_to_u2_promotion(self):
+        """256 no longer fits a byte"""
+        packed = pack_uints([0, 256])
+        assert packed["type"] == "u2"
+        assert unpack(packed) == [0, 256]
+
+    def test_u2_to_u4_promotion(self):
+        """65536 no longer fits two bytes"""
+        packed = pack_uints([65535, 65536])
+        assert packed["type"] == "u4"
+        assert unpack(packed) == [65535, 65536]
+
+    def test_empty(self):
+        """An empty column packs to an empty u1 array"""
+        packed = pack_uints([])
+        assert packed == {"type": "u1", "b64": ""}
+        assert unpack(packed) == []
+
+
+class TestEncodeTree:
+    """Tests for encode_tree function"""
+
+    def test_round_trip(self, sample_df):
+        """Decoding the payload rebuilds the original tree"""
+        tree_data = build_hierarchy(sample_df, ["Division", "Depot", "Route"], "OTP")
+        assert_same_tree(decode_payload(encode_tree(tree_data)), tree_data)
+
+    def test_round_trip_mock_data(self):
+        """Full mock hierarchy, all dimensions, both metrics"""
+        df = generate_mock_data()
+        for metric in ("OTP", "Trips"):
+            tree_data = build_hierarchy(df, ['Division', 'Depot', 'Route', 'Direction', 'Period'], metric)
+            assert_same_tree(decode_payload(encode_tree(tree_data)), tree_data)
+
+    def test_breadth_first_order(self, sample_df):
+        """Root first, then its children, then grandchildren"""
+        tree_data = build_hierarchy(sample_df, ["Division", "Depot"], "Trips")
+        payload = encode_tree(tree_data)
+        names = [payload["names"][i] for i in unpack(payload["name"])]
+        children = [c["name"] for c in tree_data["children"]]
+        assert names[:1 + len(children)] == [tree_data["name"]] + children
+        assert unpack(payload["nChildren"])[0] == len(children)
+
+    def test_bars_are_per_mille(self, sample_df):
+        """Bar fractions travel as integers from 0 to 1000"""
+        tree_data = build_hierarchy(sample_df, ["Division"], "OTP")
+        bars = unpack(encode_tree(tree_data)["bar"])
+        assert bars[1:] == [round(c["bar"] * 1000) for c in tree_data["children"]]
+        assert max(bars) == 1000
+
+    def test_nan_value_is_null(self, sample_df):
+        """A NaN average is sent as null rather than NaN"""
+        sample_df.loc[0, 'OTP'] = np.nan
+        payload = encode_tree(build_hierarchy(sample_df, ["Division"], "OTP"))
+        assert payload["value"][0] is None
+        assert all(v is None or np.isfinite(v) for v in payload["value"])
+
+    def test_name_ids_promoted_to_u2(self):
+        """More than 256 distinct names need two-byte ids"""
+        df = pd.DataFrame({
+            'Division': ['Brooklyn'] * 300,
+            'Depot': ['Fresh Pond'] * 300,
+            'Route': [f'R{i}' for i in range(300)],
+            'Direction': ['NB'] * 300,
+            'Period': ['AM'] * 300,
+            'OTP': np.linspace(60, 80, 300),
+            'Trips': [100] * 300
+        })
+        tree_data = build_hierarchy(df, ["Route"], "OTP")
+        payload = encode_tree(tree_data)
+        assert payload["name"]["type"] == "u2"
+        assert payload["bar"]["type"] == "u2"
+        assert_same_tree(decode_payload(payload), tree_data)
+
+    def test_empty_tree(self, empty_df):
+        """A root with no children still encodes and decodes"""
+        tree_data = build_hierarchy(empty_df, ["Division"], "OTP")
+        payload = encode_tree(tree_data)
+        assert unpack(payload["nChildren"]) == [0]
+        assert_same_tree(decode_payload(payload), tree_data)
+
 
 # ============================================
 # DATA GENERATION TESTS
@@ -506,6 +660,19 @@ class TestEdgeCases:
         for child in result["children"]:
             assert child["color"].startswith("#")
 
+    def test_float32_otp_without_weights(self):
+        """Downcast OTP without OTP_w is weighted in float64, like calculate_metric"""
+        df = pd.DataFrame({
+            'Division': ['Bronx', 'Bronx'],
+            'OTP': np.array([56.8, 81.4], dtype=np.float32),
+            'Trips': np.array([465, 355], dtype=np.int16)
+        })
+
+        result = build_hierarchy(df, ["Division"], "OTP")
+
+        # A float32 product here rounds to 67.4
+        assert result["children"][0]["value"] == calculate_metric(df, "OTP") == 67.5
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -0,0 +1,112 @@
+"""
+Unit tests for the NCC tree component
+Tests the columnar payload and the page HTML on both serializer paths
+"""
+
+import json
+import pytest
+import pandas as pd
+import numpy as np
+
+# Import functions from the component module (without Streamlit or Snowflake)
+import sys
+from unittest.mock import MagicMock
+
+# Mock streamlit and snowpark before importing
+mock_st = MagicMock()
+
+
+def passthrough_cache(func=None, **kwargs):
+    """Passthrough for both @st.cache_data and @st.cache_data(...)"""
+    return func if func is not None else (lambda f: f)
+
+
+mock_st.cache_data = passthrough_cache
+mock_st.cache_resource = passthrough_cache
+sys.modules['streamlit'] = mock_st
+sys.modules['snowflake'] = MagicMock()
+sys.modules['snowflake.snowpark'] = MagicMock()
+sys.modules['snowflake.snowpark.context'] = MagicMock()
+
+import tree_visualization
+from data_utils import build_tree_soa
+from tree_visualization import create_tree_html, encode_tree
+
+DIMENSIONS = ["REGION", "SYSTEM"]
+
+
+# ============================================
+# FIXTURES
+# ============================================
+
+@pytest.fixture
+def ncc_df():
+    """Aggregated rows where one system has no NCC values at all (NCC_COUNT == 0)"""
+    return pd.DataFrame({
+        'REGION': ['East', 'East', 'East', 'West'],
+        'SYSTEM': ['S1', 'S2', 'Zürich </script>', 'S1'],
+        'NCC': [3e6, 0.0, 1.5e6, 2e6],
+        'NCC_PY': [2e6, 1e6, 1e6, 2e6],
+        'NCC_COUNT': [3, 0, 2, 4],
+        'RECORD_COUNT': [3, 2, 2, 4]
+    })
+
+
+def embedded_payload(html: str) -> dict:
+    """The payload literal substituted into the page"""
+    start = html.index("const payload = ") + len("const payload = ")
+    end = html.index(";\n", start)
+    return json.loads(html[start:end].replace("<\\/", "</"))
+
+
+# ============================================
+# PAYLOAD TESTS
+# ============================================
+
+class TestEncodeTree:
+    """Tests for encode_tree function"""
+
+    def test_breadth_first_columns(self, ncc_df):
+        """Root, then regions, then systems, with child counts describing the shape"""
+        payload = encode_tree(build_tree_soa(ncc_df, DIMENSIONS, "NCC"))
+        names = [payload["names"][i] for i in payload["name"]]
+        assert names[:3] == ["Total NCC", "East", "West"]
+        assert payload["nChildren"][:3] == [2, 3, 1]
+        assert len(payload["value"]) == len(payload["count"]) == len(payload["bar"]) == 7
+
+    def test_nan_value_is_null(self, ncc_df):
+        """A missing average is sent as null rather than NaN"""
+        payload = encode_tree(build_tree_soa(ncc_df, DIMENSIONS, "Avg_NCC"))
+        names = [payload["names"][i] for i in payload["name"]]
+        assert payload["value"][names.index("S2")] is None
+        assert all(v is None or np.isfinite(v) for v in payload["value"])
+
+
+# ============================================
+# PAGE TESTS
+# ============================================
+
+class TestCreateTreeHtml:
+    """Tests for create_tree_html function"""
+
+    def test_nan_value_renders(self, ncc_df):
+        """The page carries null for a missing average and formats it as N/A"""
+        html = create_tree_html(build_tree_soa(ncc_df, DIMENSIONS, "Avg_NCC"), "Avg_NCC")
+        assert "NaN" not in html
+        assert None in embedded_payload(html)["value"]
+        assert 'if (val === null || !isFinite(val)) return "N/A";' in html
+
+    def test_script_close_escaped(self, ncc_df):
+        """A name containing </script> cannot end the script block"""
+        html = create_tree_html(build_tree_soa(ncc_df, DIMENSIONS, "NCC"), "NCC")
+        assert "Zürich </script>" not in html
+        assert "Zürich </script>" in embedded_payload(html)["names"]
+
+    @pytest.mark.parametrize("metric", ["NCC", "Avg_NCC", "YoY_Growth"])
+    def test_serializers_agree(self, ncc_df, metric, monkeypatch):
+        """orjson and the standard library fallback produce the same page"""
+        pytest.importorskip("orjson")
+        tree = build_tree_soa(ncc_df, DIMENSIONS, metric)
+        with_orjson = create_tree_html(tree, metric)
+        monkeypatch.setattr(tree_visualization, "orjson", None)
+        assert create_tree_html(tree, metric) == with_orjson